@@ -0,0 +1,281 @@
+# Response cache for Gemini calls
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional, Protocol, Tuple
+from ..database import open_connection
+from .config import CACHE_MAX_ENTRIES, CACHE_MAX_TEMPERATURE, CACHE_TTL_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Runs of whitespace carry no meaning for the model, so they are collapsed
+# before keying; everything else (numbers, doses, units) must match exactly
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+class CacheBackend(Protocol):
+    """
+    Storage interface used by LLMCache
+
+    Entries carry an absolute expiry time (epoch seconds) so a hit copied from a
+    slower backend into a faster one keeps its original deadline.
+    """
+
+    def get(self, key: str) -> Optional[Tuple[str, float]]:
+        """Return (value, expires_at) for an unexpired entry, or None"""
+        ...
+
+    def set(self, key: str, value: str, expires_at: float) -> None:
+        ...
+
+    def discard(self, value: str) -> None:
+        ...
+
+
+class MemoryBackend:
+    """In-process LRU store; expired entries are dropped when looked up"""
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, value, expires_at):
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def discard(self, value):
+        with self._lock:
+            for key in [k for k, (v, _) in self._entries.items() if v == value]:
+                del self._entries[key]
+
+
+class SQLiteBackend:
+    """Persistent store in the llm_cache table of the templates database"""
+
+    # Expired rows are purged once every this many writes
+    PURGE_EVERY = 100
+
+    def __init__(self, db_path, ttl=CACHE_TTL_SECONDS):
+        self.db_path = db_path
+        self.ttl = ttl
+        self._writes = 0
+        # One connection per thread, reused for every lookup and write
+        self._local = threading.local()
+        self._conns = []
+        self._conns_lock = threading.Lock()
+        self._pid = os.getpid()
+
+        conn = self._conn()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+        """)
+        conn.commit()
+        self.purge_expired()
+
+    def _conn(self):
+        """Return this thread's connection, opening it on first use"""
+        if self._pid != os.getpid():
+            # Forked worker (e.g. Gunicorn preload): SQLite connections must not
+            # cross fork, so drop the inherited ones without closing them
+            self._local = threading.local()
+            self._conns = []
+            self._pid = os.getpid()
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = open_connection(self.db_path)
+            self._local.conn = conn
+            with self._conns_lock:
+                self._conns.append(conn)
+        return conn
+
+    def close(self):
+        """Close every connection opened by this backend"""
+        with self._conns_lock:
+            conns, self._conns = self._conns, []
+        for conn in conns:
+            conn.close()
+        self._local = threading.local()
+
+    def get(self, key):
+        row = self._conn().execute(
+            "SELECT value, created_at FROM llm_cache WHERE key = ? AND created_at >= ?",
+            (key, time.time() - self.ttl)
+        ).fetchone()
+        return (row[0], row[1] + self.ttl) if row else None
+
+    def set(self, key, value, expires_at):
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO llm_cache (key, value, created_at) VALUES (?, ?, ?)",
+            (key, value, expires_at - self.ttl)
+        )
+        conn.commit()
+
+        self._writes += 1
+        if self._writes % self.PURGE_EVERY == 0:
+            self.purge_expired()
+
+    def discard(self, value):
+        conn = self._conn()
+        conn.execute("DELETE FROM llm_cache WHERE value = ?", (value,))
+        conn.commit()
+
+    def purge_expired(self):
+        """Delete rows older than the TTL"""
+        conn = self._conn()
+        deleted = conn.execute(
+            "DELETE FROM llm_cache WHERE created_at < ?", (time.time() - self.ttl,)
+        ).rowcount
+        conn.commit()
+        if deleted:
+            logger.info("Purged %s expired cached responses", deleted)
+
+
+class LLMCache:
+    """
+    Exact-match cache of model responses
+
+    Keys are the SHA-256 of the model, canonical contents and sampling
+    settings. Backends are checked in order (fastest first) and a hit in a
+    slower backend is copied into the faster ones with its original expiry, so
+    no entry outlives ttl anywhere. Calls sampled above CACHE_MAX_TEMPERATURE
+    are never cached since their output is meant to vary.
+    """
+
+    def __init__(self, backends: Optional[List[CacheBackend]] = None, max_temperature=CACHE_MAX_TEMPERATURE,
+                 ttl=CACHE_TTL_SECONDS):
+        self.backends = backends or [MemoryBackend()]
+        self.max_temperature = max_temperature
+        self.ttl = ttl
+        self.stats = {"hits": 0, "misses": 0}
+
+    @staticmethod
+    def _canonical(contents):
+        """
+        Canonical, JSON-serializable form of the contents
+
+        Text parts are whitespace-normalized; uploaded files are identified by
+        their SHA-256. Returns None if any part cannot be identified.
+        """
+        parts = contents if isinstance(contents, list) else [contents]
+        canon = []
+        for part in parts:
+            if isinstance(part, str):
+                canon.append(_WHITESPACE_RE.sub(" ", part).strip())
+            else:
+                file_hash = getattr(part, "sha256_hash", None)
+                if not file_hash:
+                    return None
+                canon.append({"file": file_hash})
+        return canon
+
+    def make_key(self, model, contents, max_tokens, temperature, top_p):
+        """
+        Build the cache key for a call
+
+        Args:
+            model: Model name
+            contents: Prompt string OR list [prompt, file] passed to the API
+            max_tokens: Maximum output tokens
+            temperature: Sampling temperature
+            top_p: Top P
+
+        Returns:
+            str: Hex digest, or None if the call must not be cached
+        """
+        if temperature > self.max_temperature:
+            return None
+
+        canon = self._canonical(contents)
+        if canon is None:
+            return None
+
+        payload = json.dumps({
+            "model": model,
+            "contents": canon,
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+            "top_p": top_p
+        }, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """Return cached text for key, or None"""
+        if key is None:
+            return None
+
+        for i, backend in enumerate(self.backends):
+            try:
+                entry = backend.get(key)
+            except Exception as e:
+                logger.warning("Cache lookup failed: %s", e)
+                continue
+
+            if entry is not None:
+                value, expires_at = entry
+                for faster in self.backends[:i]:
+                    faster.set(key, value, expires_at)
+                self.stats["hits"] += 1
+                return value
+
+        self.stats["misses"] += 1
+        return None
+
+    def set(self, key, value):
+        """Store text for key (no-op for uncacheable calls)"""
+        if key is None or not value:
+            return
+
+        expires_at = time.time() + self.ttl
+        for backend in self.backends:
+            try:
+                backend.set(key, value, expires_at)
+            except Exception as e:
+                logger.warning("Failed to store cached response: %s", e)
+
+    def discard(self, value):
+        """
+        Drop every entry holding value
+
+        Called when a caller could not use a cached answer (e.g. invalid JSON),
+        so a retry asks the model again instead of replaying the bad output.
+        """
+        if not value:
+            return
+
+        for backend in self.backends:
+            try:
+                backend.discard(value)
+            except Exception as e:
+                logger.warning("Failed to discard cached response: %s", e)
+
+    def close(self):
+        """Release backend resources (connections) at shutdown"""
+        for backend in self.backends:
+            close = getattr(backend, "close", None)
+            if close is not None:
+                close()
@@ -1,17 +1,26 @@
 import os
-from dotenv import load_dotenv
-
-load_dotenv()
+from ..config import env_bool  # importing backend.config loads .env before the getenv calls below
 
 # Gemini API settings
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")  # From .env (sensitive)
 GEMINI_MODEL = "gemini-2.5-flash"  # Default model for note generation
 GEMINI_TRANSCRIPTION_MODEL = "gemini-2.5-flash"  # Default model for transcription
 
+# Whisper settings (local transcription backend)
+WHISPER_MODEL = os.getenv("WHISPER_MODEL", "medium")  # e.g. distil-medium.en for English-only dictation (far fewer decoder layers)
+WHISPER_NUM_WORKERS = 2  # Concurrent transcriptions the model can run; lets one file's encoder overlap another's decoder
+WHISPER_CPU_THREADS = int(os.getenv("WHISPER_CPU_THREADS", max(1, (os.cpu_count() or 1) // WHISPER_NUM_WORKERS)))
+# Threads per worker on CPU; split across workers so they don't oversubscribe the cores
+
 # Generation settings
 MAX_TOKENS_CLEANER = 1024  # text cleaning output is usually short
 MAX_TOKENS_NOTE_GEN = 2048  # Gemini can handle larger outputs efficiently
 MAX_TOKENS_TRANSCRIPTION = 2048  # Audio transcription output
+MAX_TOKENS_TEMPLATE = 2048  # Field names with descriptions; MAX_TEMPLATE_FIELDS of them plus nesting can reach ~1k tokens
+TEMPLATE_THINKING_BUDGET = 0  
+# Thinking tokens spent before template extraction output (0 = no thinking)
+# Extracting fields needs no reasoning, and on 2.5 models thinking tokens
+# count against MAX_TOKENS_TEMPLATE, so leaving it on could truncate the JSON
 
 # Model behavior parameters
 TEMPERATURE = 0.2  
@@ -27,3 +36,39 @@ REPEAT_PENALTY = 1.1
 # Penalizes repeating the same words/phrases
 # 1.0 = no penalty, >1.0 = discourages repetition
 # Prevents model from getting stuck in loops like "patient patient patient..."
+
+# HTTP connection pool shared by all Gemini calls in the process
+HTTP_MAX_CONNECTIONS = 40
+HTTP_MAX_KEEPALIVE_CONNECTIONS = 20
+HTTP_KEEPALIVE_EXPIRY = 30  # Seconds an idle connection stays open for reuse
+HTTP_PREWARM = env_bool("GEMINI_PREWARM", True)  # Open the API connection at startup, not on the first request
+HTTP_TIMEOUT_SECONDS = 120  # Per connect/read/write; a stalled connection fails instead of hanging the request
+
+# Admission control: calls beyond GEMINI_QUEUE_MAX are rejected (HTTP 503) instead of piling up
+GEMINI_MAX_CONCURRENT = int(os.getenv("GEMINI_MAX_CONCURRENT", 8))  # Requests in flight to Gemini at once
+GEMINI_QUEUE_MAX = int(os.getenv("GEMINI_QUEUE_MAX", 32))  # Calls admitted (running, waiting or retrying)
+
+# Retry settings (decorrelated-jitter backoff between attempts)
+RETRY_BASE_DELAY = 1  # Seconds; smallest wait between attempts
+RETRY_MAX_DELAY = 60  # Seconds; longer server-requested waits fall back to the next model
+RATE_LIMIT_RETRIES = 2  # Retries of a rate-limited model before switching to a fallback
+
+# Context cache settings (server-side caching of static prompt prefixes)
+CONTEXT_CACHE_ENABLED = env_bool("GEMINI_CONTEXT_CACHE", True)
+CONTEXT_CACHE_TTL_SECONDS = 3600  # How long Gemini keeps a cached prefix
+CONTEXT_CACHE_MIN_CHARS = 4096  # Gemini rejects cached contents under ~1024 tokens (~4 chars per token)
+
+# Uploaded audio is reused for identical files (by SHA-256) for this long, then deleted from Gemini
+UPLOAD_CACHE_TTL_SECONDS = 45 * 60
+UPLOAD_SWEEP_SECONDS = 60  # How often a background task deletes uploads past that window
+
+# Response cache settings
+CACHE_ENABLED = env_bool("LLM_CACHE_ENABLED", True)
+# Also keep responses in SQLite. Off by default: cached answers are transcripts
+# and notes (patient data), stored unencrypted in the templates database
+CACHE_PERSIST = env_bool("LLM_CACHE_PERSIST", False)
+CACHE_MAX_ENTRIES = 512  # In-memory responses kept before evicting the oldest
+CACHE_TTL_SECONDS = 24 * 60 * 60  # Persisted responses older than this are purged
+CACHE_MAX_TEMPERATURE = 0.2  
+# Calls sampled above this temperature are never cached
+# 0.2 covers note generation, cleaning and transcription (all low-temperature)
@@ -1,15 +1,181 @@
 from google import genai
 from google.genai import types
+import asyncio
+import contextlib
+import hashlib
+import httpx
+import importlib.util
 import logging
+import os
+import random
+import re
+import threading
 import time
 from .config import (
     GEMINI_API_KEY, GEMINI_MODEL, GEMINI_TRANSCRIPTION_MODEL,
     MAX_TOKENS_CLEANER, MAX_TOKENS_NOTE_GEN, MAX_TOKENS_TRANSCRIPTION,
-    TEMPERATURE, TOP_P
+    MAX_TOKENS_TEMPLATE, TEMPLATE_THINKING_BUDGET,
+    TEMPERATURE, TOP_P, CACHE_ENABLED, CACHE_PERSIST,
+    CONTEXT_CACHE_ENABLED, CONTEXT_CACHE_TTL_SECONDS, CONTEXT_CACHE_MIN_CHARS,
+    RETRY_BASE_DELAY, RETRY_MAX_DELAY, RATE_LIMIT_RETRIES,
+    HTTP_MAX_CONNECTIONS, HTTP_MAX_KEEPALIVE_CONNECTIONS, HTTP_KEEPALIVE_EXPIRY, HTTP_TIMEOUT_SECONDS, HTTP_PREWARM,
+    GEMINI_MAX_CONCURRENT, GEMINI_QUEUE_MAX, UPLOAD_CACHE_TTL_SECONDS, UPLOAD_SWEEP_SECONDS
 )
+from .cache import LLMCache, MemoryBackend, SQLiteBackend
+from ..database import DB_PATH
 
 logger = logging.getLogger(__name__)
 
+# Upload MIME type by file extension; anything else is sent as WAV
+MIME_MAP = {
+    '.wav': 'audio/wav',
+    '.mp3': 'audio/mpeg',
+    '.m4a': 'audio/mp4',
+    '.ogg': 'audio/ogg',
+    '.flac': 'audio/flac',
+    '.webm': 'audio/webm',
+    '.aac': 'audio/aac',
+    '.aiff': 'audio/aiff'
+}
+
+# Error-message patterns checked on every failed call
+_RATE_LIMIT_RE = re.compile(r"rate limit|quota|resource exhausted|429|too many requests", re.IGNORECASE)
+_NETWORK_ERROR_RE = re.compile(r"10013|11001|timeout", re.IGNORECASE)
+
+# Server-suggested wait in a 429 body, e.g. "'retryDelay': '33s'" or "Please retry in 33.5s"
+_RETRY_DELAY_RE = re.compile(r"(?:retryDelay['\"]?\s*:\s*['\"]?|retry in\s+)(\d+(?:\.\d+)?)s", re.IGNORECASE)
+
+
+def _finish_reason(response):
+    """Finish reason of the response's first candidate, or None"""
+    candidates = getattr(response, "candidates", None)
+    return candidates[0].finish_reason if candidates else None
+
+
+def _build_response_cache():
+    """Create the process-wide response cache (memory, then SQLite)"""
+    if not CACHE_ENABLED:
+        return None
+    
+    backends = [MemoryBackend()]
+    if CACHE_PERSIST:
+        try:
+            backends.append(SQLiteBackend(DB_PATH))
+        except Exception as e:
+            logger.error("Persistent response cache unavailable: %s", e)
+    return LLMCache(backends)
+
+
+# Shared by every Gemini instance in the process
+response_cache = _build_response_cache()
+
+# Server-side context caches: sha256(model + prefix) -> (cache name or None, expires_at)
+# None records a failed creation (e.g. prefix below the model's minimum size)
+# so it is not retried on every call
+_context_caches = {}
+_context_cache_lock = threading.Lock()
+
+
+class GeminiOverloadedError(Exception):
+    """Raised when too many Gemini calls are already pending; the API answers 503"""
+
+
+# Admission control shared by every Gemini instance in the process. Sync and
+# async calls draw from the same GEMINI_MAX_CONCURRENT slots.
+_inflight = threading.BoundedSemaphore(GEMINI_MAX_CONCURRENT)
+# How often an async caller retries for a free slot
+_INFLIGHT_POLL_SECONDS = 0.02
+_queue_depth = 0
+_queue_lock = threading.Lock()
+
+
+@contextlib.asynccontextmanager
+async def _inflight_async():
+    """Hold one of the shared _inflight slots without blocking the event loop"""
+    while not _inflight.acquire(blocking=False):
+        await asyncio.sleep(_INFLIGHT_POLL_SECONDS)
+    try:
+        yield
+    finally:
+        _inflight.release()
+
+
+@contextlib.contextmanager
+def _admitted():
+    """Count a call against GEMINI_QUEUE_MAX for its whole duration, or reject it"""
+    global _queue_depth
+    with _queue_lock:
+        if _queue_depth >= GEMINI_QUEUE_MAX:
+            logger.warning("Rejecting Gemini call: %s calls already pending", _queue_depth)
+            raise GeminiOverloadedError("Server is busy, please try again shortly")
+        _queue_depth += 1
+    try:
+        yield
+    finally:
+        with _queue_lock:
+            _queue_depth -= 1
+
+
+# Uploaded audio files: sha256 of file bytes -> (File object, expires_at)
+_uploaded_files = {}
+_uploaded_files_lock = threading.Lock()
+
+
+def _file_sha256(audio):
+    """SHA-256 of a file (path or open binary file), read in 1 MiB chunks"""
+    h = hashlib.sha256()
+    if isinstance(audio, (str, os.PathLike)):
+        with open(audio, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+    else:
+        audio.seek(0)
+        for chunk in iter(lambda: audio.read(1 << 20), b""):
+            h.update(chunk)
+        audio.seek(0)
+    return h.hexdigest()
+
+
+def _cached_upload(file_hash):
+    """Return the still-valid uploaded File for file_hash, or None"""
+    with _uploaded_files_lock:
+        entry = _uploaded_files.get(file_hash)
+    return entry[0] if entry and entry[1] > time.time() else None
+
+
+def _remember_upload(file_hash, audio_file):
+    with _uploaded_files_lock:
+        _uploaded_files[file_hash] = (audio_file, time.time() + UPLOAD_CACHE_TTL_SECONDS)
+
+
+def _expire_upload(file_hash):
+    """Stop reusing an upload; it is deleted with the other expired uploads"""
+    with _uploaded_files_lock:
+        entry = _uploaded_files.get(file_hash)
+        if entry:
+            _uploaded_files[file_hash] = (entry[0], 0)
+
+
+def _pop_expired_uploads(everything=False):
+    """Remove expired uploads (or all of them) from the cache and return their file names"""
+    now = time.time()
+    with _uploaded_files_lock:
+        expired = [key for key, (_, expires_at) in _uploaded_files.items() if everything or expires_at <= now]
+        return [_uploaded_files.pop(key)[0].name for key in expired]
+
+
+def _context_cache_key(model, prefix):
+    return hashlib.sha256(f"{model}\n{prefix}".encode("utf-8")).hexdigest()
+
+
+def _fresh_context_cache(key):
+    """Return (found, name) for a memoized context cache that is still valid"""
+    entry = _context_caches.get(key)
+    # Treat caches as expired a minute early so calls never race the server TTL
+    if entry and entry[1] > time.time() + 60:
+        return True, entry[0]
+    return False, None
+
 
 class Gemini:
     """Gemini AI model class for medical text processing"""
@@ -24,22 +190,249 @@ class Gemini:
     def __init__(self):
         """Initialize Gemini client"""
         try:
-            self.client = genai.Client(api_key=GEMINI_API_KEY)
+            # Keep-alive pool so repeated calls skip the TCP + TLS handshake
+            limits = httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY
+            )
+            # HTTP/2 multiplexes concurrent calls over one connection; needs the optional h2 package
+            client_args = {"limits": limits, "http2": importlib.util.find_spec("h2") is not None}
+            self.client = genai.Client(
+                api_key=GEMINI_API_KEY,
+                http_options=types.HttpOptions(
+                    timeout=HTTP_TIMEOUT_SECONDS * 1000,
+                    client_args=client_args,
+                    async_client_args=client_args
+                )
+            )
             self.default_model = GEMINI_MODEL
             self.transcription_model = GEMINI_TRANSCRIPTION_MODEL
-            logger.info(f"Gemini initialized with model: {self.default_model}")
+            logger.info("Gemini initialized with model: %s", self.default_model)
         except Exception as e:
-            logger.error(f"Failed to initialize Gemini: {str(e)}")
+            logger.error("Failed to initialize Gemini: %s", e)
             raise
     
     def _is_rate_limit_error(self, error):
         """Check if error is a rate limit error"""
-        error_msg = str(error).lower()
-        return any(keyword in error_msg for keyword in [
-            'rate limit', 'quota', 'resource exhausted', '429', 'too many requests'
-        ])
+        return bool(_RATE_LIMIT_RE.search(str(error)))
+    
+    def _is_network_error(self, error):
+        """Check if error is a transient network error worth retrying on the same model"""
+        return bool(_NETWORK_ERROR_RE.search(str(error)))
+    
+    def _retry_after(self, error):
+        """Seconds the server asked us to wait (Retry-After header or RetryInfo), or None"""
+        response = getattr(error, "response", None)
+        headers = getattr(response, "headers", None)
+        if headers:
+            value = headers.get("retry-after")
+            try:
+                return float(value) if value is not None else None
+            except ValueError:
+                pass
+        
+        match = _RETRY_DELAY_RE.search(str(error))
+        return float(match.group(1)) if match else None
     
-    def _call_api_with_retry(self, model, contents, max_tokens, temperature=None, top_p=None, max_retries=3):
+    def _next_retry_delay(self, retry_delay):
+        """Decorrelated jitter: random wait between the base and 3x the previous wait"""
+        return min(RETRY_MAX_DELAY, random.uniform(RETRY_BASE_DELAY, retry_delay * 3))
+    
+    def _retry_wait(self, error, model_name, attempt, max_retries, retry_delay):
+        """
+        Decide whether a failed call is retried on the same model
+        
+        Args:
+            error: Exception raised by the API call
+            model_name: Model that was called
+            attempt: Zero-based attempt number
+            max_retries: Number of retry attempts per model
+            retry_delay: Jittered backoff delay for this attempt
+        
+        Returns:
+            float: Seconds to wait before retrying, or None to stop using this model
+        """
+        if self._is_rate_limit_error(error):
+            retry_after = self._retry_after(error) or 0
+            # Retry the same model a few times before burning a fallback model's quota,
+            # unless the server wants us to wait longer than we are willing to
+            if attempt < min(RATE_LIMIT_RETRIES, max_retries - 1) and retry_after <= RETRY_MAX_DELAY:
+                wait = max(retry_after, retry_delay)
+                logger.warning("Rate limit hit on %s, retrying in %.1fs...", model_name, wait)
+                return wait
+            logger.warning("Rate limit hit on %s, trying next model...", model_name)
+            return None
+        
+        # Network errors - retry same model
+        if self._is_network_error(error) and attempt < max_retries - 1:
+            logger.warning("API call failed (attempt %s/%s): %s", attempt + 1, max_retries, error)
+            return retry_delay
+        
+        return None
+    
+    def _get_or_create_context_cache(self, model, prefix):
+        """
+        Upload a static prompt prefix as a Gemini context cache
+        
+        Args:
+            model: Model the cache is created for (caches are model-specific)
+            prefix: Static prompt text shared by many calls
+            
+        Returns:
+            str: Cache name to pass as cached_content, or None if unavailable
+        """
+        if not CONTEXT_CACHE_ENABLED or len(prefix) < CONTEXT_CACHE_MIN_CHARS:
+            return None
+        
+        key = _context_cache_key(model, prefix)
+        
+        with _context_cache_lock:
+            found, name = _fresh_context_cache(key)
+            if found:
+                return name
+            
+            try:
+                cache = self.client.caches.create(
+                    model=model,
+                    config=types.CreateCachedContentConfig(
+                        contents=[prefix],
+                        ttl=f"{CONTEXT_CACHE_TTL_SECONDS}s"
+                    )
+                )
+                name = cache.name
+                logger.info("Created context cache %s for %s", name, model)
+            except Exception as e:
+                logger.warning("Context cache unavailable, sending full prompts: %s", e)
+                name = None
+            
+            _context_caches[key] = (name, time.time() + CONTEXT_CACHE_TTL_SECONDS)
+            return name
+    
+    async def _get_or_create_context_cache_async(self, model, prefix):
+        """Async version of _get_or_create_context_cache (creation runs in a worker thread)"""
+        if not CONTEXT_CACHE_ENABLED or len(prefix) < CONTEXT_CACHE_MIN_CHARS:
+            return None
+        
+        found, name = _fresh_context_cache(_context_cache_key(model, prefix))
+        if found:
+            return name
+        
+        return await asyncio.to_thread(self._get_or_create_context_cache, model, prefix)
+    
+    def _drop_context_cache(self, name):
+        """Forget a context cache that the server rejected"""
+        with _context_cache_lock:
+            for key, entry in list(_context_caches.items()):
+                if entry[0] == name:
+                    del _context_caches[key]
+    
+    def _call_with_instructions(self, model, instructions, prompt_input, max_tokens, json_output=False,
+                                thinking_budget=None):
+        """
+        Call the model with a static instructions prefix followed by a per-call input
+        
+        When the prefix is held in a context cache only the input is sent; if
+        that call fails the cache is dropped and the full prompt is sent instead.
+        """
+        prompt = instructions + prompt_input
+        
+        cache_name = self._get_or_create_context_cache(model, instructions)
+        if cache_name:
+            try:
+                return self._call_api_with_retry(
+                    model, prompt_input, max_tokens,
+                    cached_content=cache_name, key_contents=prompt, json_output=json_output,
+                    thinking_budget=thinking_budget
+                )
+            except GeminiOverloadedError:
+                raise
+            except Exception as e:
+                logger.warning("Cached-context call failed, retrying with full prompt: %s", e)
+                self._drop_context_cache(cache_name)
+        
+        return self._call_api_with_retry(
+            model, prompt, max_tokens, json_output=json_output, thinking_budget=thinking_budget
+        )
+    
+    async def _call_with_instructions_async(self, model, instructions, prompt_input, max_tokens, json_output=False,
+                                            thinking_budget=None):
+        """Async version of _call_with_instructions"""
+        prompt = instructions + prompt_input
+        
+        cache_name = await self._get_or_create_context_cache_async(model, instructions)
+        if cache_name:
+            try:
+                return await self._call_api_with_retry_async(
+                    model, prompt_input, max_tokens,
+                    cached_content=cache_name, key_contents=prompt, json_output=json_output,
+                    thinking_budget=thinking_budget
+                )
+            except GeminiOverloadedError:
+                raise
+            except Exception as e:
+                logger.warning("Cached-context call failed, retrying with full prompt: %s", e)
+                self._drop_context_cache(cache_name)
+        
+        return await self._call_api_with_retry_async(
+            model, prompt, max_tokens, json_output=json_output, thinking_budget=thinking_budget
+        )
+    
+    def _prepare_call(self, model, contents, max_tokens, temperature, top_p, cached_content, key_contents,
+                      json_output=False, thinking_budget=None):
+        """
+        Resolve sampling defaults, response cache key and models to try for one call
+        
+        Returns:
+            tuple: (config, cache_key, cached_text, models_to_try)
+        """
+        temperature = temperature or TEMPERATURE
+        top_p = top_p or TOP_P
+        
+        config = types.GenerateContentConfig(
+            temperature=temperature,
+            top_p=top_p,
+            max_output_tokens=max_tokens,
+            cached_content=cached_content,
+            response_mime_type="application/json" if json_output else None,
+            thinking_config=types.ThinkingConfig(thinking_budget=thinking_budget) if thinking_budget is not None else None
+        )
+        
+        cache_key = None
+        cached = None
+        if response_cache is not None:
+            cache_key = response_cache.make_key(model, key_contents or contents, max_tokens, temperature, top_p)
+            cached = response_cache.get(cache_key)
+            if cached is not None:
+                logger.info("Response cache hit (%s hits so far)", response_cache.stats['hits'])
+        
+        if cached_content:
+            models_to_try = [model]
+        else:
+            models_to_try = [model] + [m for m in self.FALLBACK_MODELS if m != model]
+        
+        return config, cache_key, cached, models_to_try
+    
+    def _finish_call(self, response, model, model_name, cache_key):
+        """
+        Extract the text of a successful response
+        
+        Only responses the model finished on its own (STOP) are stored in the
+        response cache; truncated (MAX_TOKENS) or blocked output is not.
+        """
+        if model_name != model:
+            logger.info("Successfully used fallback model: %s", model_name)
+        
+        text = response.text.strip()
+        if response_cache is not None:
+            if _finish_reason(response) == types.FinishReason.STOP:
+                response_cache.set(cache_key, text)
+            else:
+                logger.warning("Not caching response that ended with %s", _finish_reason(response))
+        return text
+    
+    def _call_api_with_retry(self, model, contents, max_tokens, temperature=None, top_p=None, max_retries=3,
+                             cached_content=None, key_contents=None, json_output=False, thinking_budget=None):
         """
         Call Gemini API with retry logic and model fallback for rate limits
         
@@ -50,49 +443,114 @@ class Gemini:
             temperature: Temperature (optional, uses config default)
             top_p: Top P (optional, uses config default)
             max_retries: Number of retry attempts per model
+            cached_content: Context cache name holding the prompt prefix (optional).
+                Caches are tied to one model, so no fallback models are tried.
+            key_contents: Full prompt used for the response cache key when
+                contents is only the suffix of a cached prefix (optional)
+            json_output: Ask for application/json output (JSON mode), so the
+                response is a bare JSON document with no surrounding prose
+            thinking_budget: Thinking tokens allowed before the answer
+                (optional, model default if None; 0 disables thinking)
             
         Returns:
             str: Generated text
         """
-        models_to_try = [model] + [m for m in self.FALLBACK_MODELS if m != model]
+        config, cache_key, cached, models_to_try = self._prepare_call(
+            model, contents, max_tokens, temperature, top_p, cached_content, key_contents, json_output,
+            thinking_budget
+        )
+        if cached is not None:
+            return cached
         
+        with _admitted():
+            return self._call_models(model, contents, config, cache_key, models_to_try, max_retries)
+    
+    def _call_models(self, model, contents, config, cache_key, models_to_try, max_retries):
+        """Retry/fallback loop of _call_api_with_retry; at most GEMINI_MAX_CONCURRENT requests run at once"""
         for model_name in models_to_try:
-            retry_delay = 2
+            retry_delay = RETRY_BASE_DELAY
             last_error = None
             
             for attempt in range(max_retries):
                 try:
-                    response = self.client.models.generate_content(
-                        model=model_name,
-                        contents=contents,
-                        config=types.GenerateContentConfig(
-                            temperature=temperature or TEMPERATURE,
-                            top_p=top_p or TOP_P,
-                            max_output_tokens=max_tokens
+                    with _inflight:
+                        response = self.client.models.generate_content(
+                            model=model_name,
+                            contents=contents,
+                            config=config
                         )
-                    )
+                    return self._finish_call(response, model, model_name, cache_key)
+                
+                except Exception as api_error:
+                    last_error = api_error
                     
-                    if model_name != model:
-                        logger.info(f"Successfully used fallback model: {model_name}")
+                    retry_delay = self._next_retry_delay(retry_delay)
+                    wait = self._retry_wait(api_error, model_name, attempt, max_retries, retry_delay)
+                    if wait is not None:
+                        time.sleep(wait)
+                        continue
                     
-                    return response.text.strip()
+                    if self._is_rate_limit_error(api_error):
+                        break
                     
+                    raise
+            
+            if last_error and not self._is_rate_limit_error(last_error):
+                raise last_error
+        
+        raise Exception(f"API rate limit exceeded on all models. Models tried: {', '.join(models_to_try)}")
+    
+    async def _call_api_with_retry_async(self, model, contents, max_tokens, temperature=None, top_p=None,
+                                         max_retries=3, cached_content=None, key_contents=None, json_output=False,
+                                         thinking_budget=None):
+        """
+        Async version of _call_api_with_retry using the client's aio interface,
+        so waiting on Gemini does not block the event loop
+        
+        Args:
+            Same as _call_api_with_retry
+        
+        Returns:
+            str: Generated text
+        """
+        config, cache_key, cached, models_to_try = self._prepare_call(
+            model, contents, max_tokens, temperature, top_p, cached_content, key_contents, json_output,
+            thinking_budget
+        )
+        if cached is not None:
+            return cached
+        
+        with _admitted():
+            return await self._call_models_async(model, contents, config, cache_key, models_to_try, max_retries)
+    
+    async def _call_models_async(self, model, contents, config, cache_key, models_to_try, max_retries):
+        """Async version of _call_models"""
+        for model_name in models_to_try:
+            retry_delay = RETRY_BASE_DELAY
+            last_error = None
+            
+            for attempt in range(max_retries):
+                try:
+                    async with _inflight_async():
+                        response = await self.client.aio.models.generate_content(
+                            model=model_name,
+                            contents=contents,
+                            config=config
+                        )
+                    return self._finish_call(response, model, model_name, cache_key)
+                
                 except Exception as api_error:
                     last_error = api_error
-                    error_msg = str(api_error)
+                    
+                    retry_delay = self._next_retry_delay(retry_delay)
+                    wait = self._retry_wait(api_error, model_name, attempt, max_retries, retry_delay)
+                    if wait is not None:
+                        await asyncio.sleep(wait)
+                        continue
                     
                     if self._is_rate_limit_error(api_error):
-                        logger.warning(f"Rate limit hit on {model_name}, trying next model...")
                         break
                     
-                    # Network errors - retry same model
-                    if "10013" in error_msg or "11001" in error_msg or "timeout" in error_msg.lower():
-                        if attempt < max_retries - 1:
-                            logger.warning(f"API call failed (attempt {attempt + 1}/{max_retries}): {error_msg}")
-                            time.sleep(retry_delay)
-                            retry_delay *= 2
-                            continue
-                    
                     raise
             
             if last_error and not self._is_rate_limit_error(last_error):
@@ -114,10 +572,22 @@ class Gemini:
         if model is None:
             model = self.default_model
         
-        from backend.prompts import text_cleaner_prompt
-        prompt = text_cleaner_prompt(transcribed_text)
+        from backend.prompts import text_cleaner_instructions, text_cleaner_input
         
-        return self._call_api_with_retry(model, prompt, MAX_TOKENS_CLEANER)
+        return self._call_with_instructions(
+            model, text_cleaner_instructions(), text_cleaner_input(transcribed_text), MAX_TOKENS_CLEANER
+        )
+    
+    async def gemini_clean_text_async(self, transcribed_text, model=None):
+        """Async version of gemini_clean_text"""
+        if model is None:
+            model = self.default_model
+        
+        from backend.prompts import text_cleaner_instructions, text_cleaner_input
+        
+        return await self._call_with_instructions_async(
+            model, text_cleaner_instructions(), text_cleaner_input(transcribed_text), MAX_TOKENS_CLEANER
+        )
     
     def gemini_generate_note(self, cleaned_text, template_json, model=None):
         """
@@ -134,10 +604,65 @@ class Gemini:
         if model is None:
             model = self.default_model
         
+        from backend.prompts import note_generator_instructions, note_generator_input
+        
+        # Send only the conversation when the instructions + template are cached server-side
+        return self._call_with_instructions(
+            model, note_generator_instructions(template_json), note_generator_input(cleaned_text), MAX_TOKENS_NOTE_GEN,
+            json_output=True
+        )
+    
+    async def gemini_generate_note_async(self, cleaned_text, template_json, model=None):
+        """Async version of gemini_generate_note"""
+        if model is None:
+            model = self.default_model
+        
+        from backend.prompts import note_generator_instructions, note_generator_input
+        
+        return await self._call_with_instructions_async(
+            model, note_generator_instructions(template_json), note_generator_input(cleaned_text), MAX_TOKENS_NOTE_GEN,
+            json_output=True
+        )
+    
+    def gemini_generate_note_stream(self, cleaned_text, template_json, model=None):
+        """
+        Generate structured medical note, yielding text as the model produces it
+        
+        Uses the full prompt on a single model: a stream that has already
+        produced output cannot be retried or moved to a fallback model.
+        
+        Args:
+            cleaned_text: Cleaned medical text
+            template_json: Template structure (dict)
+            model: Model name (optional, uses default if None)
+        
+        Yields:
+            str: Chunks of the generated note JSON
+        """
+        if model is None:
+            model = self.default_model
+        
         from backend.prompts import note_generator_prompt
         prompt = note_generator_prompt(cleaned_text, template_json)
         
-        return self._call_api_with_retry(model, prompt, MAX_TOKENS_NOTE_GEN)
+        config, cache_key, cached, _ = self._prepare_call(
+            model, prompt, MAX_TOKENS_NOTE_GEN, None, None, None, None, json_output=True
+        )
+        if cached is not None:
+            yield cached
+            return
+        
+        chunks = []
+        finish_reason = None
+        with _admitted(), _inflight:
+            for chunk in self.client.models.generate_content_stream(model=model, contents=prompt, config=config):
+                finish_reason = _finish_reason(chunk) or finish_reason
+                if chunk.text:
+                    chunks.append(chunk.text)
+                    yield chunk.text
+        
+        if response_cache is not None and finish_reason == types.FinishReason.STOP:
+            response_cache.set(cache_key, "".join(chunks).strip())
     
     def gemini_create_template(self, document_text, model=None):
         """
@@ -153,18 +678,95 @@ class Gemini:
         if model is None:
             model = self.default_model
         
-        from backend.prompts import template_extraction_prompt
-        prompt = template_extraction_prompt(document_text)
+        from backend.prompts import template_extraction_instructions, template_extraction_input
+        
+        return self._call_with_instructions(
+            model, template_extraction_instructions(), template_extraction_input(document_text), MAX_TOKENS_TEMPLATE,
+            json_output=True, thinking_budget=TEMPLATE_THINKING_BUDGET
+        )
+    
+    async def gemini_create_template_async(self, document_text, model=None):
+        """Async version of gemini_create_template"""
+        if model is None:
+            model = self.default_model
+        
+        from backend.prompts import template_extraction_instructions, template_extraction_input
         
-        return self._call_api_with_retry(model, prompt, MAX_TOKENS_NOTE_GEN)
+        return await self._call_with_instructions_async(
+            model, template_extraction_instructions(), template_extraction_input(document_text), MAX_TOKENS_TEMPLATE,
+            json_output=True, thinking_budget=TEMPLATE_THINKING_BUDGET
+        )
     
-    def gemini_transcribe(self, audio_file_path, model=None):
+    def _prepare_audio(self, audio, file_name=None):
+        """
+        Validate an audio file and work out its upload metadata
+        
+        Args:
+            audio: Path to audio file OR open binary file (e.g. an upload's spooled file)
+            file_name: Original file name, used for the MIME type of file objects
+        
+        Returns:
+            tuple: (file_size_mb, mime_type, file_name)
+        """
+        if isinstance(audio, (str, os.PathLike)):
+            # Validate file (one stat for both existence and size)
+            try:
+                file_size = os.stat(audio).st_size
+            except FileNotFoundError:
+                raise FileNotFoundError(f"Audio file not found: {audio}") from None
+            file_name = file_name or os.path.basename(audio)
+        else:
+            file_size = audio.seek(0, os.SEEK_END)
+            audio.seek(0)
+            file_name = file_name or "audio"
+        
+        if file_size == 0:
+            raise ValueError("Audio file is empty")
+        
+        # Determine MIME type
+        mime_type = MIME_MAP.get(os.path.splitext(file_name)[1].lower(), 'audio/wav')
+        
+        return file_size / (1024 * 1024), mime_type, file_name
+    
+    def _upload_audio(self, audio, mime_type, file_name):
+        """Upload an audio file (path or open binary file) to Gemini and return the File handle"""
+        # Upload file to Gemini with display name to help with type detection
+        config = types.UploadFileConfig(mime_type=mime_type, display_name=file_name)
+        if isinstance(audio, (str, os.PathLike)):
+            with open(audio, 'rb') as f:
+                audio_file = self.client.files.upload(file=f, config=config)
+        else:
+            # Uploaded straight from the request's file, no temp copy on disk
+            audio.seek(0)
+            audio_file = self.client.files.upload(file=audio, config=config)
+        logger.info("File uploaded: %s", audio_file.name)
+        return audio_file
+    
+    def _delete_expired_uploads(self):
+        """Delete uploaded audio whose reuse window has passed from Gemini's file store"""
+        for name in _pop_expired_uploads():
+            try:
+                self.client.files.delete(name=name)
+            except Exception as e:
+                logger.warning("Failed to delete uploaded file %s: %s", name, e)
+    
+    async def _delete_expired_uploads_async(self, everything=False):
+        """Async version of _delete_expired_uploads; everything=True deletes all tracked uploads"""
+        for name in _pop_expired_uploads(everything):
+            try:
+                await self.client.aio.files.delete(name=name)
+            except Exception as e:
+                logger.warning("Failed to delete uploaded file %s: %s", name, e)
+    
+    def gemini_transcribe(self, audio_file_path, model=None, file_name=None):
         """
         Transcribe audio using Gemini
         
         Args:
-            audio_file_path: Path to audio file
+            audio_file_path: Path to audio file OR open binary file
             model: Model name (optional, uses transcription model if None)
+            file_name: Original file name (optional; needed for the MIME type
+                when audio_file_path is a file object)
             
         Returns:
             dict: Transcription result with keys:
@@ -173,7 +775,6 @@ class Gemini:
                 - file_size_mb (float): File size in MB
                 - error (str): Error message if failed
         """
-        import os
         from backend.prompts import audio_transcription_prompt
         
         result = {
@@ -183,77 +784,231 @@ class Gemini:
             'error': ''
         }
         
+        file_hash = None
         try:
             if model is None:
                 model = self.transcription_model
             
-            # Validate file
-            if not os.path.exists(audio_file_path):
-                raise FileNotFoundError(f"Audio file not found: {audio_file_path}")
+            result['file_size_mb'], mime_type, file_name = self._prepare_audio(audio_file_path, file_name)
+            
+            logger.info("Transcribing audio with Gemini: %s", file_name)
+            self._delete_expired_uploads()
             
-            file_size = os.path.getsize(audio_file_path)
-            if file_size == 0:
-                raise ValueError("Audio file is empty")
+            # Reuse an earlier upload of the same audio instead of uploading it again
+            file_hash = _file_sha256(audio_file_path)
+            audio_file = _cached_upload(file_hash)
+            if audio_file is not None:
+                logger.info("Reusing uploaded file: %s", audio_file.name)
+            else:
+                audio_file = self._upload_audio(audio_file_path, mime_type, file_name)
+                
+                # Wait for file to be processed
+                # Poll quickly at first (small files are ready almost at once), then back off
+                delay = 0.1
+                while audio_file.state == "PROCESSING":
+                    time.sleep(delay)
+                    delay = min(delay * 1.5, 3.0)
+                    audio_file = self.client.files.get(name=audio_file.name)
+                
+                if audio_file.state == "FAILED":
+                    raise RuntimeError("Gemini failed to process audio file")
+                
+                _remember_upload(file_hash, audio_file)
             
-            result['file_size_mb'] = file_size / (1024 * 1024)
+            # Transcribe using unified API method with fallback
+            transcribed_text = self._call_api_with_retry(
+                model=model,
+                contents=[audio_transcription_prompt(), audio_file],
+                max_tokens=MAX_TOKENS_TRANSCRIPTION,
+                temperature=0.1
+            )
             
-            logger.info(f"Transcribing audio with Gemini: {audio_file_path}")
+            result.update({
+                'success': True,
+                'text': transcribed_text
+            })
             
-            # Determine MIME type
-            import mimetypes
-            mime_type, _ = mimetypes.guess_type(audio_file_path)
-            if mime_type is None:
-                ext = os.path.splitext(audio_file_path)[1].lower()
-                mime_map = {
-                    '.wav': 'audio/wav',
-                    '.mp3': 'audio/mpeg',
-                    '.m4a': 'audio/mp4',
-                    '.ogg': 'audio/ogg',
-                    '.flac': 'audio/flac',
-                    '.webm': 'audio/webm'
-                }
-                mime_type = mime_map.get(ext, 'audio/wav')
+            logger.info("Gemini transcription completed: %s characters", len(transcribed_text))
+            return result
+        
+        except GeminiOverloadedError:
+            raise
+        except Exception as e:
+            error_msg = str(e)
+            logger.error("Gemini transcription failed: %s", error_msg)
+            result['error'] = error_msg
+            # The uploaded file may be what failed, so upload afresh next time
+            if file_hash:
+                _expire_upload(file_hash)
+            return result
+    
+    async def gemini_transcribe_async(self, audio_file_path, model=None, file_name=None):
+        """
+        Async version of gemini_transcribe; waits for file processing with
+        asyncio.sleep instead of blocking the event loop
+        
+        Args:
+            audio_file_path: Path to audio file OR open binary file
+            model: Model name (optional, uses transcription model if None)
+            file_name: Original file name (optional, see gemini_transcribe)
+        
+        Returns:
+            dict: Same shape as gemini_transcribe
+        """
+        from backend.prompts import audio_transcription_prompt
+        
+        result = {
+            'success': False,
+            'text': '',
+            'file_size_mb': 0,
+            'error': ''
+        }
+        
+        file_hash = None
+        try:
+            if model is None:
+                model = self.transcription_model
             
-            # Upload file to Gemini with display name to help with type detection
-            file_name = os.path.basename(audio_file_path)
-            with open(audio_file_path, 'rb') as audio:
-                # Create file with metadata
-                from google.genai.types import UploadFileConfig
-                config = UploadFileConfig(mime_type=mime_type, display_name=file_name)
-                audio_file = self.client.files.upload(file=audio, config=config)
-            logger.info(f"File uploaded: {audio_file.name}")
+            result['file_size_mb'], mime_type, file_name = self._prepare_audio(audio_file_path, file_name)
             
-            # Wait for file to be processed
-            import time
-            while audio_file.state == "PROCESSING":
-                time.sleep(2)
-                audio_file = self.client.files.get(name=audio_file.name)
+            logger.info("Transcribing audio with Gemini: %s", file_name)
+            await self._delete_expired_uploads_async()
             
-            if audio_file.state == "FAILED":
-                raise RuntimeError("Gemini failed to process audio file")
+            file_hash = await asyncio.to_thread(_file_sha256, audio_file_path)
+            audio_file = _cached_upload(file_hash)
+            if audio_file is not None:
+                logger.info("Reusing uploaded file: %s", audio_file.name)
+            else:
+                # Reading and uploading the file blocks, so it runs in a worker thread
+                audio_file = await asyncio.to_thread(self._upload_audio, audio_file_path, mime_type, file_name)
+                
+                # Wait for file to be processed without blocking other requests
+                # Poll quickly at first (small files are ready almost at once), then back off
+                delay = 0.1
+                while audio_file.state == "PROCESSING":
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 1.5, 3.0)
+                    audio_file = await self.client.aio.files.get(name=audio_file.name)
+                
+                if audio_file.state == "FAILED":
+                    raise RuntimeError("Gemini failed to process audio file")
+                
+                _remember_upload(file_hash, audio_file)
             
-            # Transcribe using unified API method with fallback
-            from backend.prompts import audio_transcription_prompt
-            transcribed_text = self._call_api_with_retry(
+            transcribed_text = await self._call_api_with_retry_async(
                 model=model,
                 contents=[audio_transcription_prompt(), audio_file],
                 max_tokens=MAX_TOKENS_TRANSCRIPTION,
                 temperature=0.1
             )
             
-            # Clean up uploaded file
-            self.client.files.delete(name=audio_file.name)
-            
             result.update({
                 'success': True,
                 'text': transcribed_text
             })
             
-            logger.info(f"Gemini transcription completed: {len(transcribed_text)} characters")
+            logger.info("Gemini transcription completed: %s characters", len(transcribed_text))
             return result
-            
+        
+        except GeminiOverloadedError:
+            raise
         except Exception as e:
             error_msg = str(e)
-            logger.error(f"Gemini transcription failed: {error_msg}")
+            logger.error("Gemini transcription failed: %s", error_msg)
             result['error'] = error_msg
+            # The uploaded file may be what failed, so upload afresh next time
+            if file_hash:
+                _expire_upload(file_hash)
             return result
+
+
+_gemini = None
+_gemini_lock = threading.Lock()
+
+
+def get_gemini():
+    """
+    Process-wide Gemini instance, so every module shares one client and connection pool
+    
+    Created on first use rather than at import, so importing the backend stays
+    cheap. Returns None if the client cannot be created; the next call retries.
+    """
+    global _gemini
+    if _gemini is None:
+        with _gemini_lock:
+            if _gemini is None:
+                try:
+                    _gemini = Gemini()
+                    logger.info("Gemini initialized")
+                except Exception as e:
+                    logger.error("Failed to initialize Gemini: %s", e)
+    return _gemini
+
+
+def discard_response(text):
+    """Forget a cached model answer the caller could not use (e.g. it was not valid JSON)"""
+    if response_cache is not None and text:
+        response_cache.discard(text.strip())
+
+
+async def prewarm_gemini():
+    """
+    Create the shared client and open its async connection (DNS, TCP, TLS) at startup
+    
+    Looks up the default model's metadata, which costs no tokens. Failures are
+    only logged; the first real request then connects as usual.
+    """
+    if not HTTP_PREWARM:
+        return
+    
+    gemini = get_gemini()
+    if gemini is None:
+        return
+    
+    try:
+        await gemini.client.aio.models.get(model=gemini.default_model)
+        logger.info("Gemini connection prewarmed")
+    except Exception as e:
+        logger.warning("Gemini prewarm failed: %s", e)
+
+
+_upload_sweeper = None
+
+
+async def _sweep_uploads():
+    """Delete expired uploads every UPLOAD_SWEEP_SECONDS, even when no transcription runs"""
+    while True:
+        await asyncio.sleep(UPLOAD_SWEEP_SECONDS)
+        gemini = _gemini
+        if gemini is not None:
+            await gemini._delete_expired_uploads_async()
+
+
+def start_upload_sweeper():
+    """
+    Start the background upload deletion task on the running loop (called at startup)
+    
+    Patient audio is otherwise only removed by Gemini's own 48 hour expiry.
+    """
+    global _upload_sweeper
+    if _upload_sweeper is None:
+        _upload_sweeper = asyncio.get_running_loop().create_task(_sweep_uploads())
+
+
+async def close_gemini():
+    """
+    Delete every upload still kept for reuse, then close the shared client's
+    connection pools and the response cache (called at shutdown)
+    """
+    global _gemini, _upload_sweeper
+    if _upload_sweeper is not None:
+        _upload_sweeper.cancel()
+        _upload_sweeper = None
+    with _gemini_lock:
+        gemini, _gemini = _gemini, None
+    if gemini is not None:
+        await gemini._delete_expired_uploads_async(everything=True)
+        await gemini.client.aio.aclose()
+        gemini.client.close()
+    if response_cache is not None:
+        response_cache.close()
@@ -1,21 +1,61 @@
 import os
+from typing import Final
 from dotenv import load_dotenv
 
+# The only place .env is loaded; backend/LLM/config.py relies on this module
 load_dotenv()
 
+_TRUE = frozenset({"1", "true", "yes", "on"})
+
+def available_cpus() -> int:
+    """CPUs this process may use: its affinity set, capped by a cgroup v2 quota (containers)"""
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            cpus = min(cpus, max(1, int(quota) // int(period)))
+    except (OSError, ValueError):
+        pass
+    return cpus
+
+def env_bool(name: str, default: bool = False) -> bool:
+    """Read a boolean environment variable (1/true/yes/on, any case); default if unset"""
+    value = os.environ.get(name)
+    return default if value is None else value.strip().lower() in _TRUE
+
 # App settings
-APP_ENV = "production"  # production or development
+APP_ENV: Final[str] = os.getenv("APP_ENV", "production")  # production or development
 DATABASE_URL = "sqlite:///./templates.db"  # SQLite database path
 SECRET_KEY = os.getenv("SECRET_KEY", "your_secret_key")  # From .env (sensitive)
 
 # Document upload settings
 MAX_UPLOAD_SIZE = 10 * 1024 * 1024  # 10MB
+UPLOAD_COPY_BUFFER = 1024 * 1024  # 1 MiB chunks when copying uploads to disk
+
+# Audio upload settings (extensions match the MIME types known to the Gemini client)
+MAX_AUDIO_UPLOAD_SIZE = 100 * 1024 * 1024  # 100MB
+ALLOWED_AUDIO_EXTENSIONS = ['.wav', '.mp3', '.m4a', '.ogg', '.flac', '.webm', '.aac', '.aiff']
+
+# Template settings
 ALLOWED_EXTENSIONS = ['.pdf', '.docx']
 MIN_TEMPLATE_FIELDS = 3
 MAX_TEMPLATE_FIELDS = 50
 TEMPLATE_DIR = os.path.join(os.path.dirname(__file__), "..", "templates")
 
-# Server settings
-HOST = "0.0.0.0"  # Bind to all interfaces
-PORT = 8000  # Server port
-RELOAD = False  # Disable auto-reload in production
+# Server settings (read once at import; the environment does not change mid-process)
+HOST: Final[str] = os.getenv("HOST", "0.0.0.0")  # Bind to all interfaces
+PORT: Final[int] = int(os.getenv("PORT", 8000))  # Server port (Render provides this)
+UDS_PATH: Final[str] = os.getenv("UDS_PATH", "")  # Unix socket to serve on instead of HOST:PORT (same-host proxy)
+RELOAD: Final[bool] = env_bool("RELOAD")  # Only honored in development
+ASGI_SERVER: Final[str] = os.getenv("ASGI_SERVER", "uvicorn").lower()  # uvicorn, granian or gunicorn (each only if installed)
+# Server processes; request handling is async, so one per core keeps every core busy
+WEB_CONCURRENCY: Final[int] = int(os.getenv("WEB_CONCURRENCY", os.getenv("WORKERS", available_cpus())))
+KEEPALIVE_TIMEOUT: Final[int] = int(os.getenv("KEEPALIVE_TIMEOUT", 5))  # Seconds an idle keep-alive connection is held
+LIMIT_CONCURRENCY: Final[int] = int(os.getenv("LIMIT_CONCURRENCY", 256))  # Connections per worker before new ones get HTTP 503
+BACKLOG: Final[int] = int(os.getenv("BACKLOG", 2048))  # Pending TCP connections the kernel queues
+
+# Word export settings
+# Processes building .docx files (CPU-bound, GIL-bound) in each server worker;
+# the default splits the CPUs between workers so the total stays at the core count
+DOCX_WORKERS = int(os.getenv("DOCX_WORKERS", max(1, available_cpus() // WEB_CONCURRENCY)))
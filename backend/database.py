@@ -1,8 +1,9 @@
 import sqlite3
-import json
+from . import json_utils
 import os
+import threading
+from cachetools import TTLCache
 from typing import Dict, Any, Optional, List
-from datetime import datetime
 import logging
 
 logger = logging.getLogger(__name__)
@@ -12,23 +13,147 @@ DB_PATH = os.getenv("DB_PATH", os.path.join(os.path.dirname(__file__), "..", "te
 
 # Ensure directory exists
 os.makedirs(os.path.dirname(os.path.abspath(DB_PATH)), exist_ok=True)
-logger.info(f"Using database path: {DB_PATH}")
+logger.info("Using database path: %s", DB_PATH)
+
+# Bumped when init_database() has schema changes or default templates to apply;
+# stored in PRAGMA user_version so later startups can skip the setup entirely
+SCHEMA_VERSION = 2
+
+# One connection per thread, opened on first use and reused afterwards;
+# _conns tracks them all so shutdown can close them
+_local = threading.local()
+_conns = []
+_conns_lock = threading.Lock()
+
+# Template CRUD statements. The same SQL string is reused on every call, so
+# sqlite3's per-connection statement cache parses and plans each one only once.
+_STMTS = {
+    "save": """
+        INSERT INTO templates (name, fields, field_count)
+        VALUES (?, ?, ?)
+        ON CONFLICT(name) DO UPDATE SET
+            fields = excluded.fields,
+            field_count = excluded.field_count,
+            updated_at = CURRENT_TIMESTAMP
+    """,
+    "get": "SELECT fields FROM templates WHERE name = ?",
+    "list": "SELECT name, field_count, created_at, updated_at FROM templates ORDER BY created_at DESC",
+    # Same listing, serialized to a JSON array by SQLite itself
+    "list_json": """
+        SELECT coalesce(json_group_array(json_object(
+            'name', name,
+            'field_count', field_count,
+            'created_at', created_at,
+            'updated_at', updated_at
+        )), '[]')
+        FROM (SELECT name, field_count, created_at, updated_at FROM templates ORDER BY created_at DESC)
+    """,
+    "delete": "DELETE FROM templates WHERE name = ?",
+}
+
+# Parsed templates and the template listing, dropped on every write in this process.
+# The TTL bounds how long writes made by other worker processes stay invisible.
+TEMPLATE_CACHE_TTL_SECONDS = 600
+_template_cache = TTLCache(maxsize=1024, ttl=TEMPLATE_CACHE_TTL_SECONDS)
+_list_cache = TTLCache(maxsize=2, ttl=TEMPLATE_CACHE_TTL_SECONDS)
+# Names that were looked up and not found; kept briefly so a template created
+# by another worker process shows up soon
+MISSING_TEMPLATE_TTL_SECONDS = 30
+_missing_templates = TTLCache(maxsize=256, ttl=MISSING_TEMPLATE_TTL_SECONDS)
+_cache_lock = threading.Lock()
+
+def invalidate_template(name: str):
+    """Forget a cached template (and the listing) after it was written or deleted"""
+    with _cache_lock:
+        _template_cache.pop(name, None)
+        _missing_templates.pop(name, None)
+        _list_cache.clear()
+
+# SQLite allows a single writer; serializing writes in-process avoids "database is locked" retries
+_write_lock = threading.Lock()
+
+def open_connection(path: str = DB_PATH) -> sqlite3.Connection:
+    """
+    Open a tuned connection to the database file at path
+    
+    Every module that touches the templates database (including the LLM
+    response cache) opens it here, so whichever runs first creates the file
+    with the right page size.
+    """
+    conn = sqlite3.connect(path, check_same_thread=False)
+    # Only takes effect on a brand-new database, so it must run before switching to WAL
+    conn.execute("PRAGMA page_size=8192")
+    # WAL lets readers run alongside a writer; NORMAL sync is safe in WAL mode
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA journal_size_limit=67108864")  # truncate the WAL back to 64 MB after checkpoints
+    conn.execute("PRAGMA wal_autocheckpoint=1000")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA mmap_size=268435456")
+    conn.execute("PRAGMA cache_size=-64000")  # 64 MB page cache, kept for the connection's lifetime
+    return conn
+
+def _get_conn() -> sqlite3.Connection:
+    """Return this thread's database connection, opening it on first use"""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = open_connection(DB_PATH)
+        _local.conn = conn
+        with _conns_lock:
+            _conns.append(conn)
+    return conn
+
+def close_connections():
+    """Close every connection opened by _get_conn (called at shutdown)"""
+    global _local
+    with _conns_lock:
+        conns = _conns[:]
+        _conns.clear()
+    for conn in conns:
+        conn.close()
+    _local = threading.local()
 
 def init_database():
-    """Initialize the templates database and insert default templates"""
-    conn = sqlite3.connect(DB_PATH)
+    """Initialize the templates database and insert default templates (once per process)"""
+    if getattr(init_database, "_done", False):
+        return
+    
+    conn = _get_conn()
     cursor = conn.cursor()
     
+    if cursor.execute("PRAGMA user_version").fetchone()[0] >= SCHEMA_VERSION:
+        init_database._done = True
+        return
+    
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS templates (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             name TEXT UNIQUE NOT NULL,
-            fields TEXT NOT NULL,
+            fields BLOB NOT NULL,
+            field_count INTEGER,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
     """)
     
+    # Databases created before field_count existed: add the column and backfill it
+    columns = [row[1] for row in cursor.execute("PRAGMA table_info(templates)")]
+    if "field_count" not in columns:
+        cursor.execute("ALTER TABLE templates ADD COLUMN field_count INTEGER")
+        rows = cursor.execute("SELECT id, fields FROM templates").fetchall()
+        cursor.executemany(
+            "UPDATE templates SET field_count = ? WHERE id = ?",
+            [(count_fields(json_utils.loads(fields_json)), row_id) for row_id, fields_json in rows]
+        )
+        logger.info("Added field_count column to %s templates", len(rows))
+    
+    # Covers every column list_templates reads, so listing is an index-only walk with no sort
+    cursor.execute("DROP INDEX IF EXISTS idx_templates_created")
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_templates_listing
+        ON templates(created_at DESC, name, field_count, updated_at)
+    """)
+    
     conn.commit()
     
     # Insert default templates if they don't exist
@@ -113,15 +238,16 @@ def init_database():
     for template in default_templates:
         try:
             cursor.execute("""
-                INSERT OR IGNORE INTO templates (name, fields, created_at, updated_at)
-                VALUES (?, ?, ?, ?)
-            """, (template["name"], json.dumps(template["fields"]), datetime.now(), datetime.now()))
-            logger.info(f"Default template '{template['name']}' ensured in database")
+                INSERT OR IGNORE INTO templates (name, fields, field_count)
+                VALUES (?, ?, ?)
+            """, (template["name"], json_utils.dumpb(template["fields"]), count_fields(template["fields"])))
+            logger.info("Default template '%s' ensured in database", template['name'])
         except Exception as e:
-            logger.error(f"Error inserting default template '{template['name']}': {e}")
+            logger.error("Error inserting default template '%s': %s", template['name'], e)
     
+    cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
     conn.commit()
-    conn.close()
+    init_database._done = True
 
 def save_template(name: str, fields: Dict[str, Any]) -> bool:
     """
@@ -135,26 +261,20 @@ def save_template(name: str, fields: Dict[str, Any]) -> bool:
         bool: True if successful
     """
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
+        conn = _get_conn()
         
-        fields_json = json.dumps(fields)
+        # Stored as UTF-8 JSON bytes (BLOB): no str decode on write, parsed straight from bytes on read
+        fields_json = json_utils.dumpb(fields)
         
         # Try to insert, if name exists, update
-        cursor.execute("""
-            INSERT INTO templates (name, fields, created_at, updated_at)
-            VALUES (?, ?, ?, ?)
-            ON CONFLICT(name) DO UPDATE SET
-                fields = excluded.fields,
-                updated_at = excluded.updated_at
-        """, (name, fields_json, datetime.now(), datetime.now()))
+        with _write_lock, conn:
+            conn.execute(_STMTS["save"], (name, fields_json, count_fields(fields)))
+        invalidate_template(name)
         
-        conn.commit()
-        conn.close()
         return True
     except Exception as e:
         import logging
-        logging.error(f"Error saving template: {e}")
+        logging.error("Error saving template: %s", e)
         return False
 
 def get_template(name: str) -> Optional[Dict[str, Any]]:
@@ -167,21 +287,28 @@ def get_template(name: str) -> Optional[Dict[str, Any]]:
     Returns:
         Dict with fields or None if not found
     """
+    with _cache_lock:
+        fields = _template_cache.get(name)
+        missing = name in _missing_templates
+    if fields is not None:
+        return fields
+    if missing:
+        return None
+    
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT fields FROM templates WHERE name = ?", (name,))
-        result = cursor.fetchone()
-        
-        conn.close()
+        result = _get_conn().execute(_STMTS["get"], (name,)).fetchone()
         
         if result:
-            return json.loads(result[0])
+            fields = json_utils.loads(result[0])
+            with _cache_lock:
+                _template_cache[name] = fields
+            return fields
+        with _cache_lock:
+            _missing_templates[name] = True
         return None
     except Exception as e:
         import logging
-        logging.error(f"Error fetching template: {e}")
+        logging.error("Error fetching template: %s", e)
         return None
 
 def list_templates() -> List[Dict[str, Any]]:
@@ -191,36 +318,49 @@ def list_templates() -> List[Dict[str, Any]]:
     Returns:
         List of template info dicts
     """
+    with _cache_lock:
+        templates = _list_cache.get("all")
+    if templates is not None:
+        return templates
+    
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            SELECT name, fields, created_at, updated_at 
-            FROM templates 
-            ORDER BY created_at DESC
-        """)
-        results = cursor.fetchall()
-        
-        conn.close()
+        results = _get_conn().execute(_STMTS["list"]).fetchall()
         
         templates = []
         for row in results:
-            name, fields_json, created_at, updated_at = row
-            fields = json.loads(fields_json)
+            name, field_count, created_at, updated_at = row
             templates.append({
                 "name": name,
-                "field_count": count_fields(fields),
+                "field_count": field_count,
                 "created_at": created_at,
                 "updated_at": updated_at
             })
         
+        with _cache_lock:
+            _list_cache["all"] = templates
         return templates
     except Exception as e:
         import logging
-        logging.error(f"Error listing templates: {e}")
+        logging.error("Error listing templates: %s", e)
         return []
 
+def list_templates_json_bytes() -> bytes:
+    """
+    List all templates as a JSON array, serialized by SQLite in one query
+    
+    Returns:
+        UTF-8 JSON bytes with the same entries as list_templates()
+    """
+    with _cache_lock:
+        body = _list_cache.get("json")
+    if body is not None:
+        return body
+    
+    body = _get_conn().execute(_STMTS["list_json"]).fetchone()[0].encode("utf-8")
+    with _cache_lock:
+        _list_cache["json"] = body
+    return body
+
 def delete_template(name: str) -> bool:
     """
     Delete a template from database
@@ -232,30 +372,34 @@ def delete_template(name: str) -> bool:
         bool: True if successful
     """
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
+        conn = _get_conn()
         
-        cursor.execute("DELETE FROM templates WHERE name = ?", (name,))
+        with _write_lock, conn:
+            cursor = conn.execute(_STMTS["delete"], (name,))
         deleted = cursor.rowcount > 0
-        
-        conn.commit()
-        conn.close()
+        invalidate_template(name)
         
         return deleted
     except Exception as e:
         import logging
-        logging.error(f"Error deleting template: {e}")
+        logging.error("Error deleting template: %s", e)
         return False
 
-def count_fields(fields_dict: Dict[str, Any]) -> int:
-    """Count total number of fields recursively"""
+def count_fields(fields_dict: Dict[str, Any], limit: Optional[int] = None) -> int:
+    """
+    Count total number of leaf fields, including nested sections
+    
+    If limit is given, counting stops as soon as the total exceeds it, so the
+    result is only exact up to limit + 1.
+    """
     count = 0
-    for value in fields_dict.values():
-        if isinstance(value, dict):
-            count += count_fields(value)
-        else:
-            count += 1
+    stack = [fields_dict]
+    while stack:
+        for value in stack.pop().values():
+            if isinstance(value, dict):
+                stack.append(value)
+            else:
+                count += 1
+                if limit is not None and count > limit:
+                    return count
     return count
-
-# Initialize database on module import
-init_database()
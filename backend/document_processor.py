@@ -17,18 +17,20 @@ def extract_text_from_pdf(file_path):
     try:
         import fitz  # PyMuPDF
         
-        doc = fitz.open(file_path)
-        text = ""
+        # Plain text only; no ligature handling or other extras beyond the default mode
+        flags = fitz.TEXT_PRESERVE_WHITESPACE | fitz.TEXT_MEDIABOX_CLIP
         
-        for page in doc:
-            text += page.get_text()
+        doc = fitz.open(file_path)
+        try:
+            text = "".join(page.get_text("text", flags=flags) for page in doc)
+        finally:
+            doc.close()
         
-        doc.close()
-        logger.info(f"Extracted {len(text)} chars from PDF")
+        logger.info("Extracted %d chars from PDF", len(text))
         return text.strip()
         
     except Exception as e:
-        logger.error(f"PDF extraction failed: {str(e)}")
+        logger.error("PDF extraction failed: %s", e)
         raise
 
 
@@ -46,24 +48,26 @@ def extract_text_from_docx(file_path):
         from docx import Document
         
         doc = Document(file_path)
-        text = ""
+        parts = []
         
         # Extract from paragraphs
         for para in doc.paragraphs:
-            text += para.text + "\n"
+            parts.append(para.text + "\n")
         
         # Extract from tables
         for table in doc.tables:
             for row in table.rows:
                 for cell in row.cells:
-                    text += cell.text + " "
-                text += "\n"
+                    parts.append(cell.text + " ")
+                parts.append("\n")
+        
+        text = "".join(parts)
         
-        logger.info(f"Extracted {len(text)} chars from DOCX")
+        logger.info("Extracted %d chars from DOCX", len(text))
         return text.strip()
         
     except Exception as e:
-        logger.error(f"DOCX extraction failed: {str(e)}")
+        logger.error("DOCX extraction failed: %s", e)
         raise
 
 
@@ -85,11 +89,12 @@ def extract_text(file_path):
     }
     
     try:
-        if not os.path.exists(file_path):
-            raise FileNotFoundError(f"File not found: {file_path}")
+        # Check existence and size with a single stat
+        try:
+            file_size = os.stat(file_path).st_size
+        except FileNotFoundError:
+            raise FileNotFoundError(f"File not found: {file_path}") from None
         
-        # Check file size
-        file_size = os.path.getsize(file_path)
         from .config import MAX_UPLOAD_SIZE
         
         if file_size > MAX_UPLOAD_SIZE:
@@ -110,14 +115,11 @@ def extract_text(file_path):
         
         result["success"] = True
         result["text"] = text
-        logger.info(f"Successfully extracted text from {os.path.basename(file_path)}")
+        logger.info("Successfully extracted text from %s", os.path.basename(file_path))
         
     except Exception as e:
         error_msg = str(e)
-        logger.error(f"Text extraction error: {error_msg}")
+        logger.error("Text extraction error: %s", error_msg)
         result["error"] = error_msg
     
     return result
-
-
-# Test
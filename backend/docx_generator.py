@@ -3,10 +3,120 @@ Word document generation utilities for medical notes and templates
 """
 import io
 import time
+from functools import lru_cache
 from typing import Dict, Any
+from xml.sax.saxutils import escape
 from docx import Document
+from docx.oxml import parse_xml
+from docx.oxml.ns import nsdecls
 from docx.shared import Pt, RGBColor
 from docx.enum.text import WD_ALIGN_PARAGRAPH
+from .note_formatter import format_field_name
+
+# Pre-built (paragraph properties, run properties) for the note body (sizes are in half-points)
+_HEADING = ('<w:pPr><w:pStyle w:val="Heading2"/></w:pPr>', '<w:rPr><w:color w:val="667EEA"/></w:rPr>')
+_SUBHEADING = ('', '<w:rPr><w:b/><w:sz w:val="22"/></w:rPr>')
+_BODY = ('', '<w:rPr><w:sz w:val="22"/></w:rPr>')
+_BULLET = ('<w:pPr><w:pStyle w:val="ListBullet"/></w:pPr>', '<w:rPr><w:sz w:val="20"/></w:rPr>')
+
+# 12pt after the last paragraph of a field, in place of an empty spacer paragraph (twentieths of a point)
+_FIELD_SPACING = '<w:spacing w:after="240"/>'
+
+
+def _with_field_spacing(style):
+    ppr, rpr = style
+    if ppr:
+        ppr = ppr.replace('</w:pPr>', _FIELD_SPACING + '</w:pPr>')
+    else:
+        ppr = f'<w:pPr>{_FIELD_SPACING}</w:pPr>'
+    return ppr, rpr
+
+
+_SPACED = {style: _with_field_spacing(style) for style in (_HEADING, _SUBHEADING, _BODY, _BULLET)}
+
+# Rule under the document header, drawn as a paragraph border instead of a line of underscores
+_HEADER_RULE = f'<w:pBdr {nsdecls("w")}><w:bottom w:val="single" w:sz="6" w:space="4" w:color="auto"/></w:pBdr>'
+# pPr children that must follow pBdr (schema order) among those the header paragraphs can have
+_AFTER_PBDR = ('w:shd', 'w:tabs', 'w:spacing', 'w:ind', 'w:jc')
+
+# Colors and font sizes shared by every document
+_ACCENT_COLOR = RGBColor(102, 126, 234)
+_MUTED_COLOR = RGBColor(108, 117, 125)
+_PT9 = Pt(9)
+_PT11 = Pt(11)
+_PT12 = Pt(12)
+_PT14 = Pt(14)
+
+
+@lru_cache(maxsize=1)
+def _skeleton_bytes() -> bytes:
+    """The blank default document, saved once"""
+    doc_io = io.BytesIO()
+    Document().save(doc_io)
+    return doc_io.getvalue()
+
+
+def _new_document():
+    """
+    Fresh blank document opened from the in-memory skeleton
+    
+    About twice as fast as Document(), which locates and reads the default
+    template package from disk on every call.
+    """
+    return Document(io.BytesIO(_skeleton_bytes()))
+
+
+def _note_entries(note_data: Dict[str, Any]) -> list:
+    """
+    Flatten note fields into (style, text) paragraph entries in document order
+    
+    Nesting is resolved here so the XML emission is a single linear pass.
+    """
+    entries = []
+    for key, value in note_data.items():
+        # Skip internal fields
+        if key.startswith('_'):
+            continue
+        
+        entries.append((_HEADING, format_field_name(key)))
+        
+        if isinstance(value, dict):
+            # Handle nested objects (recursively for triple-nested dicts)
+            for sub_key, sub_value in value.items():
+                sub_field_name = format_field_name(sub_key)
+                
+                # Check if sub_value is also a dict (triple-nested)
+                if isinstance(sub_value, dict):
+                    entries.append((_SUBHEADING, f"{sub_field_name}:"))
+                    entries.extend(
+                        (_BULLET, f"  • {format_field_name(nested_key)}: {nested_value}")
+                        for nested_key, nested_value in sub_value.items()
+                    )
+                else:
+                    entries.append((_BODY, f"{sub_field_name}: {sub_value}"))
+        else:
+            entries.append((_BODY, str(value)))
+        
+        # Space after the field's last paragraph
+        style, text = entries[-1]
+        entries[-1] = (_SPACED[style], text)
+    
+    return entries
+
+
+def _add_header_rule(paragraph):
+    """Draw a horizontal rule below paragraph"""
+    paragraph._p.get_or_add_pPr().insert_element_before(parse_xml(_HEADER_RULE), *_AFTER_PBDR)
+
+
+def _paragraph_xml(style, text: str) -> str:
+    """WordprocessingML for a single-run paragraph (newlines and tabs become breaks and tabs like run.text)"""
+    ppr, rpr = style
+    text = escape(text)
+    if '\n' in text or '\t' in text:
+        text = (text.replace('\n', '</w:t><w:br/><w:t xml:space="preserve">')
+                    .replace('\t', '</w:t><w:tab/><w:t xml:space="preserve">'))
+    return f'<w:p>{ppr}<w:r>{rpr}<w:t xml:space="preserve">{text}</w:t></w:r></w:p>'
 
 
 def generate_note_docx(template_name: str, note_data: Dict[str, Any]) -> io.BytesIO:
@@ -21,65 +131,34 @@ def generate_note_docx(template_name: str, note_data: Dict[str, Any]) -> io.Byte
         BytesIO: Word document as bytes
     """
     # Create Word document
-    doc = Document()
+    doc = _new_document()
     
     # Add title
     title = doc.add_heading('Medical Note', 0)
     title.alignment = WD_ALIGN_PARAGRAPH.CENTER
     
     # Add template name
+    header = title
     if template_name:
-        template_para = doc.add_paragraph(f'Template: {template_name}')
-        template_para.alignment = WD_ALIGN_PARAGRAPH.CENTER
-        template_run = template_para.runs[0]
-        template_run.font.size = Pt(12)
-        template_run.font.color.rgb = RGBColor(108, 117, 125)
+        header = doc.add_paragraph(f'Template: {template_name}')
+        header.alignment = WD_ALIGN_PARAGRAPH.CENTER
+        template_run = header.runs[0]
+        template_run.font.size = _PT12
+        template_run.font.color.rgb = _MUTED_COLOR
         template_run.italic = True
     
     # Add horizontal line
-    doc.add_paragraph('_' * 80)
+    _add_header_rule(header)
     
-    # Add note fields
-    for key, value in note_data.items():
-        # Skip internal fields
-        if key.startswith('_'):
-            continue
-        
-        # Format field name
-        field_name = key.replace('_', ' ').title()
-        
-        # Field heading
-        field_heading = doc.add_heading(field_name, level=2)
-        field_heading.runs[0].font.color.rgb = RGBColor(102, 126, 234)
-        
-        # Field content
-        if isinstance(value, dict):
-            # Handle nested objects (recursively for triple-nested dicts)
-            for sub_key, sub_value in value.items():
-                sub_field_name = sub_key.replace('_', ' ').title()
-                
-                # Check if sub_value is also a dict (triple-nested)
-                if isinstance(sub_value, dict):
-                    # Add sub-heading
-                    sub_heading = doc.add_paragraph(f"{sub_field_name}:")
-                    sub_heading.runs[0].bold = True
-                    sub_heading.runs[0].font.size = Pt(11)
-                    
-                    # Add nested items
-                    for nested_key, nested_value in sub_value.items():
-                        nested_field = nested_key.replace('_', ' ').title()
-                        nested_para = doc.add_paragraph(f"  • {nested_field}: {nested_value}", style='List Bullet')
-                        nested_para.runs[0].font.size = Pt(10)
-                else:
-                    # Regular nested field
-                    content = doc.add_paragraph(f"{sub_field_name}: {sub_value}")
-                    content.runs[0].font.size = Pt(11)
-        else:
-            content = doc.add_paragraph(str(value))
-            content.runs[0].font.size = Pt(11)
-        
-        # Add spacing
-        doc.add_paragraph()
+    # Add note fields. The body is built as raw XML and parsed once, since
+    # add_paragraph/add_heading re-resolve styles on every call.
+    entries = _note_entries(note_data)
+    if entries:
+        body_xml = ''.join([_paragraph_xml(style, text) for style, text in entries])
+        fragment = parse_xml(f'<w:body {nsdecls("w")}>{body_xml}</w:body>')
+        sect_pr = doc.element.body.sectPr
+        for paragraph in list(fragment):
+            sect_pr.addprevious(paragraph)
     
     # Save to bytes
     doc_io = io.BytesIO()
@@ -101,7 +180,7 @@ def generate_template_docx(template_name: str, fields: Dict[str, Any]) -> io.Byt
         BytesIO: Word document as bytes
     """
     # Create Word document
-    doc = Document()
+    doc = _new_document()
     
     # Add title
     title = doc.add_heading(template_name, 0)
@@ -111,33 +190,33 @@ def generate_template_docx(template_name: str, fields: Dict[str, Any]) -> io.Byt
     subtitle = doc.add_paragraph('Medical Template Structure')
     subtitle.alignment = WD_ALIGN_PARAGRAPH.CENTER
     subtitle_run = subtitle.runs[0]
-    subtitle_run.font.size = Pt(14)
-    subtitle_run.font.color.rgb = RGBColor(108, 117, 125)
+    subtitle_run.font.size = _PT14
+    subtitle_run.font.color.rgb = _MUTED_COLOR
     subtitle_run.italic = True
     
     # Add horizontal line
-    doc.add_paragraph('_' * 80)
+    _add_header_rule(subtitle)
     
     # Add fields
     for key, value in fields.items():
         # Field title
-        field_heading = doc.add_heading(key.replace('_', ' ').title(), level=2)
-        field_heading.runs[0].font.color.rgb = RGBColor(102, 126, 234)
+        field_heading = doc.add_heading(format_field_name(key), level=2)
+        field_heading.runs[0].font.color.rgb = _ACCENT_COLOR
         
         # Field description
         desc = doc.add_paragraph(value.get('description', 'No description provided'))
         desc_run = desc.runs[0]
-        desc_run.font.size = Pt(11)
+        desc_run.font.size = _PT11
         
         # Field type
         type_para = doc.add_paragraph(f"Type: {value.get('type', 'text')}")
         type_run = type_para.runs[0]
-        type_run.font.size = Pt(9)
-        type_run.font.color.rgb = RGBColor(102, 126, 234)
+        type_run.font.size = _PT9
+        type_run.font.color.rgb = _ACCENT_COLOR
         type_run.bold = True
         
         # Add spacing
-        doc.add_paragraph()
+        type_para.paragraph_format.space_after = _PT12
     
     # Save to bytes
     doc_io = io.BytesIO()
@@ -0,0 +1,42 @@
+# JSON helpers: orjson when it is installed, stdlib json otherwise
+try:
+    import orjson
+    
+    JSONDecodeError = orjson.JSONDecodeError  # subclass of json.JSONDecodeError
+    
+    def dumps(obj) -> str:
+        """Serialize obj to a compact JSON string"""
+        return orjson.dumps(obj).decode()
+    
+    def dumpb(obj) -> bytes:
+        """Serialize obj to compact UTF-8 JSON bytes"""
+        return orjson.dumps(obj)
+    
+    def dumps_pretty(obj) -> str:
+        """Serialize obj to a JSON string indented by two spaces"""
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2).decode()
+    
+    def loads(data):
+        """Parse JSON from str or bytes"""
+        return orjson.loads(data)
+
+except ImportError:
+    import json
+    
+    JSONDecodeError = json.JSONDecodeError
+    
+    def dumps(obj) -> str:
+        """Serialize obj to a compact JSON string"""
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+    
+    def dumpb(obj) -> bytes:
+        """Serialize obj to compact UTF-8 JSON bytes"""
+        return dumps(obj).encode("utf-8")
+    
+    def dumps_pretty(obj) -> str:
+        """Serialize obj to a JSON string indented by two spaces"""
+        return json.dumps(obj, ensure_ascii=False, indent=2)
+    
+    def loads(data):
+        """Parse JSON from str or bytes"""
+        return json.loads(data)
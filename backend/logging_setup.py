@@ -0,0 +1,74 @@
+"""
+Process-wide logging configuration
+"""
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+from pathlib import Path
+
+LOG_DIR = "logs"
+LOG_FORMAT = '%(levelname)s - %(message)s'
+
+_listener = None
+_queue_handler = None
+_setup_lock = threading.Lock()
+
+
+def _start_listener(handlers):
+    """Point the root QueueHandler at a fresh queue and start a listener thread draining it"""
+    global _listener
+    log_queue = queue.SimpleQueue()
+    _queue_handler.queue = log_queue
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+
+def _restart_listener_after_fork():
+    """
+    Forked children (Gunicorn preload workers, Word export processes) inherit
+    the QueueHandler but not the listener thread, so they get their own
+    """
+    if _listener is not None:
+        _start_listener(_listener.handlers)
+
+
+def setup_logging(level=logging.INFO):
+    """
+    Configure the root logger once per process: console plus logs/app.log
+    
+    Request threads only put records on a queue; a QueueListener thread does
+    the formatting and the file/console writes. Repeated calls (e.g. module
+    reloads) are no-ops, so handlers never accumulate.
+    """
+    global _queue_handler
+    with _setup_lock:
+        if _listener is not None:
+            return
+        
+        Path(LOG_DIR).mkdir(parents=True, exist_ok=True)
+        
+        # LOG_FORMAT uses none of these, so skip collecting them for every record
+        # (_srcfile = None skips the stack walk for file/line/function)
+        logging.logThreads = False
+        logging.logProcesses = False
+        logging.logMultiprocessing = False
+        logging._srcfile = None
+        
+        formatter = logging.Formatter(LOG_FORMAT)
+        file_handler = logging.FileHandler(os.path.join(LOG_DIR, 'app.log'))
+        stream_handler = logging.StreamHandler()
+        for handler in (file_handler, stream_handler):
+            handler.setFormatter(formatter)
+        
+        root = logging.getLogger()
+        root.setLevel(level)
+        _queue_handler = logging.handlers.QueueHandler(queue.SimpleQueue())
+        root.addHandler(_queue_handler)
+        
+        _start_listener((file_handler, stream_handler))
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=_restart_listener_after_fork)
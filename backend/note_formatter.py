@@ -1,9 +1,15 @@
+from functools import lru_cache
 from typing import Dict, Any
 
+# HTML indentation for nested fields
+INDENT = "&nbsp;" * 4
+INDENT_2 = INDENT * 2
 
+
+@lru_cache(maxsize=4096)
 def format_field_name(field_name: str) -> str:
     """
-    Format field name from snake_case to Title Case.
+    Format field name from snake_case to Title Case (memoized; the same keys recur across notes).
     
     Args:
         field_name: Field name in snake_case
@@ -25,7 +31,7 @@ def format_medical_note(note_data: Dict[str, Any], template_name: str = "") -> s
     Returns:
         Formatted string with line breaks
     """
-    result = f"Template: {template_name}<br><br>" if template_name else ""
+    parts = [f"Template: {template_name}<br><br>"] if template_name else []
     
     for key, value in note_data.items():
         # Skip internal fields (starting with underscore)
@@ -35,22 +41,22 @@ def format_medical_note(note_data: Dict[str, Any], template_name: str = "") -> s
         formatted_key = format_field_name(key)
             
         if isinstance(value, dict):
-            result += f"<strong>{formatted_key}:</strong><br>"
+            parts.append(f"<strong>{formatted_key}:</strong><br>")
             for sub_key, sub_value in value.items():
                 formatted_sub_key = format_field_name(sub_key)
                 # Handle nested dictionaries recursively
                 if isinstance(sub_value, dict):
-                    result += f"&nbsp;&nbsp;&nbsp;&nbsp;<strong>{formatted_sub_key}:</strong><br>"
+                    parts.append(f"{INDENT}<strong>{formatted_sub_key}:</strong><br>")
                     for nested_key, nested_value in sub_value.items():
                         formatted_nested_key = format_field_name(nested_key)
-                        result += f"&nbsp;&nbsp;&nbsp;&nbsp;&nbsp;&nbsp;&nbsp;&nbsp;{formatted_nested_key}: {nested_value}<br>"
+                        parts.append(f"{INDENT_2}{formatted_nested_key}: {nested_value}<br>")
                 else:
-                    result += f"&nbsp;&nbsp;&nbsp;&nbsp;{formatted_sub_key}: {sub_value}<br>"
-            result += "<br>"
+                    parts.append(f"{INDENT}{formatted_sub_key}: {sub_value}<br>")
+            parts.append("<br>")
         else:
-            result += f"<strong>{formatted_key}:</strong> {value}<br><br>"
+            parts.append(f"<strong>{formatted_key}:</strong> {value}<br><br>")
     
-    return result
+    return "".join(parts)
 
 
 def format_template_document(fields: Dict[str, Any], template_name: str = "") -> str:
@@ -64,7 +70,7 @@ def format_template_document(fields: Dict[str, Any], template_name: str = "") ->
     Returns:
         Formatted string with line breaks
     """
-    result = f"<strong>Template:</strong> {template_name}<br><br>" if template_name else ""
+    parts = [f"<strong>Template:</strong> {template_name}<br><br>"] if template_name else []
     
     for key, value in fields.items():
         formatted_key = format_field_name(key)
@@ -72,13 +78,13 @@ def format_template_document(fields: Dict[str, Any], template_name: str = "") ->
         if isinstance(value, dict):
             description = value.get('description', '')
             field_type = value.get('type', '')
-            result += f"<strong>{formatted_key}:</strong><br>"
+            parts.append(f"<strong>{formatted_key}:</strong><br>")
             if description:
-                result += f"&nbsp;&nbsp;&nbsp;&nbsp;Description: {description}<br>"
+                parts.append(f"{INDENT}Description: {description}<br>")
             if field_type:
-                result += f"&nbsp;&nbsp;&nbsp;&nbsp;Type: {field_type}<br>"
-            result += "<br>"
+                parts.append(f"{INDENT}Type: {field_type}<br>")
+            parts.append("<br>")
         else:
-            result += f"<strong>{formatted_key}:</strong> {value}<br><br>"
+            parts.append(f"<strong>{formatted_key}:</strong> {value}<br><br>")
     
-    return result
+    return "".join(parts)
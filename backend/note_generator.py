@@ -1,12 +1,16 @@
 # This module generates structured medical notes from text
+import asyncio
+import hashlib
 import logging
-import os
-import json
+import re
+import threading
 import time
+from cachetools import TTLCache
 from pydantic import BaseModel
 from typing import Dict, Any
-from .LLM.gemini import Gemini
+from .LLM.gemini import get_gemini, discard_response, GeminiOverloadedError
 from .database import get_template
+from . import json_utils
 
 # Pydantic Models
 class GenerateNoteRequest(BaseModel):
@@ -20,29 +24,35 @@ class GenerateNoteResponse(BaseModel):
     formatted_html: str = ""
     error: str | None = None
 
-# Configure logging
-LOG_DIR = "logs"
-if not os.path.exists(LOG_DIR):
-    os.makedirs(LOG_DIR)
+logger = logging.getLogger(__name__)
 
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(os.path.join(LOG_DIR, 'note_generator.log')),
-        logging.StreamHandler()
-    ]
-)
+# Parsed notes keyed by hash(template, cleaned text), kept for an hour. Exact
+# matches only (up to whitespace): a similar-but-different transcript must
+# never reuse another patient's note.
+NOTE_CACHE_TTL_SECONDS = 3600
+_note_cache = TTLCache(maxsize=256, ttl=NOTE_CACHE_TTL_SECONDS)
+_note_cache_lock = threading.Lock()
 
-logger = logging.getLogger(__name__)
+# Generations in progress, by the same key. Identical requests that arrive
+# while one is running wait for its result instead of calling Gemini again.
+_pending_notes: Dict[str, asyncio.Future] = {}
+
+# JSON scanning: structural characters outside strings, and the remainder of a
+# string up to its closing quote (skipping backslash escapes)
+_JSON_STRUCTURE_RE = re.compile(r'[{}"]')
+_JSON_STRING_TAIL_RE = re.compile(r'[^"\\]*(?:\\.[^"\\]*)*"', re.DOTALL)
+# Structural characters needed to split a streamed object into its top-level members
+_JSON_MEMBER_RE = re.compile(r'[{}\[\],"]')
 
-# Initialize Gemini
-try:
-    gemini = Gemini()
-    logger.info("Gemini initialized for note generation")
-except Exception as e:
-    logger.error(f"Failed to initialize Gemini: {str(e)}")
-    gemini = None
+
+def _note_cache_key(cleaned_text, template_json):
+    # Whitespace is normalized (re-transcriptions often differ only in line
+    # breaks and spacing); wording, case and numbers must match exactly
+    h = hashlib.blake2b(digest_size=16)
+    h.update(json_utils.dumpb(template_json))
+    h.update(b"\0")
+    h.update(" ".join(cleaned_text.split()).encode("utf-8"))
+    return h.hexdigest()
 
 
 def load_template(template_name):
@@ -56,85 +66,347 @@ def load_template(template_name):
         Dict with template fields or None if not found
     """
     # Remove .json extension if present
-    if template_name.endswith('.json'):
-        template_name = template_name[:-5]
+    template_name = template_name.removesuffix('.json')
     
     # Fetch from database
     template_fields = get_template(template_name)
     
     if template_fields:
-        logger.info(f"Loaded template '{template_name}' from database")
+        logger.info("Loaded template '%s' from database", template_name)
         return template_fields
     
-    logger.error(f"Template '{template_name}' not found in database")
+    logger.error("Template '%s' not found in database", template_name)
     return None
 
 
-def generate_note_from_text(cleaned_text, template_json):
+def _extract_json_span(text):
+    """
+    Find the first balanced {...} object in text in a single pass
+    
+    Outside strings only braces and quotes are visited; a string is skipped in
+    one regex match up to its closing (unescaped) quote, so braces inside
+    values never count and trailing prose is never scanned.
+    
+    Returns:
+        tuple: (start, end) of the object, (start, len(text)) if it is never
+               closed, or None if there is no '{'
+    """
+    start = text.find('{')
+    if start == -1:
+        return None
+    
+    find_structure = _JSON_STRUCTURE_RE.search
+    match_string_tail = _JSON_STRING_TAIL_RE.match
+    depth = 0
+    pos = start
+    while True:
+        match = find_structure(text, pos)
+        if match is None:
+            return start, len(text)
+        pos = match.end()
+        char = match.group()
+        if char == '"':
+            tail = match_string_tail(text, pos)
+            if tail is None:
+                return start, len(text)
+            pos = tail.end()
+        elif char == '{':
+            depth += 1
+        else:
+            depth -= 1
+            if depth == 0:
+                return start, pos
+
+
+def extract_first_json(text):
+    """
+    Slice out the first balanced {...} object in text
+    
+    Returns:
+        str: The object text, the text from the first '{' if it is never
+             closed, or None if there is no '{'
+    """
+    span = _extract_json_span(text)
+    if span is None:
+        return None
+    return text[span[0]:span[1]]
+
+
+class NoteStreamParser:
+    """
+    Incremental parser for a note object that arrives in chunks
+    
+    feed() returns the top-level fields completed by each chunk, already
+    parsed, so callers can use a field as soon as the model finishes it.
+    Consumed text is dropped from the buffer as fields complete.
+    """
+    
+    def __init__(self):
+        self.done = False
+        self._buffer = ""
+        self._pos = 0
+        self._depth = 0
+        self._member_start = None
+    
+    def feed(self, chunk):
+        """
+        Add a chunk of model output
+        
+        Returns:
+            list: (key, value) pairs of the top-level fields completed by this chunk
+        """
+        if self.done:
+            return []
+        
+        text = self._buffer + chunk
+        pos = self._pos
+        fields = []
+        while True:
+            match = _JSON_MEMBER_RE.search(text, pos)
+            if match is None:
+                pos = len(text)
+                break
+            
+            char = match.group()
+            if char == '"':
+                tail = _JSON_STRING_TAIL_RE.match(text, match.end())
+                if tail is None:
+                    # String not finished yet; rescan it with the next chunk
+                    pos = match.start()
+                    break
+                pos = tail.end()
+                continue
+            
+            pos = match.end()
+            if char in '{[':
+                self._depth += 1
+                if self._depth == 1:
+                    self._member_start = pos
+            elif char in '}]':
+                self._depth -= 1
+                if self._depth == 0:
+                    fields.extend(self._parse_member(text[self._member_start:match.start()]))
+                    self.done = True
+                    break
+            elif self._depth == 1:
+                fields.extend(self._parse_member(text[self._member_start:match.start()]))
+                self._member_start = pos
+        
+        # Keep only the unfinished member (or the unscanned tail)
+        cut = pos if self._member_start is None or self.done else self._member_start
+        self._buffer = text[cut:]
+        self._pos = pos - cut
+        if self._member_start is not None:
+            self._member_start -= cut
+        return fields
+    
+    @staticmethod
+    def _parse_member(member):
+        """Parse one '"key": value' member, or nothing if it is empty or malformed"""
+        if not member.strip():
+            return []
+        try:
+            return list(json_utils.loads("{" + member + "}").items())
+        except json_utils.JSONDecodeError:
+            return []
+
+
+def parse_note_json(generated_text):
+    """
+    Parse the note JSON out of the model's output
+    
+    Args:
+        generated_text: Raw model output
+    
+    Returns:
+        dict: Parsed note
+    
+    Raises:
+        JSONDecodeError: If the output is not valid JSON
+    """
+    # Usual case: the model returned bare JSON, which the C parser can take as-is
+    stripped = generated_text.strip()
+    if stripped.startswith('{') and stripped.endswith('}'):
+        try:
+            return json_utils.loads(stripped)
+        except json_utils.JSONDecodeError:
+            pass
+    
+    # Minimal cleanup - just find JSON boundaries if model adds anything
+    json_text = extract_first_json(generated_text)
+    if json_text is None:
+        json_text = generated_text
+    
+    return json_utils.loads(json_text)
+
+
+async def generate_note_by_name(cleaned_text, template_name):
+    """
+    Generate structured medical note from cleaned text using a stored template
+    
+    Args:
+        cleaned_text: The cleaned medical conversation text
+        template_name: Name of the template in the database
+    
+    Returns:
+        dict: Generated medical note following template structure
+    """
+    template_json = load_template(template_name)
+    if template_json is None:
+        return {"error": "Failed to load template"}
+    
+    return await generate_note_from_text(cleaned_text, template_json)
+
+
+async def generate_note_from_text(cleaned_text, template_json):
     """
     Generate structured medical note from cleaned text using template
     
     Args:
         cleaned_text: The cleaned medical conversation text
-        template_json: JSON template (dict or path to file)
+        template_json: JSON template (dict)
     
     Returns:
         dict: Generated medical note following template structure
     """
+    gemini = get_gemini()
     if gemini is None:
         logger.error("Gemini not initialized")
         return {"error": "Gemini not available"}
     
-    # Load template if it's a filename
-    if isinstance(template_json, str):
-        template_json = load_template(template_json)
-        if template_json is None:
-            return {"error": "Failed to load template"}
+    cache_key = _note_cache_key(cleaned_text, template_json)
+    while True:
+        with _note_cache_lock:
+            cached_note = _note_cache.get(cache_key)
+            pending = None
+            if cached_note is None:
+                pending = _pending_notes.get(cache_key)
+                is_leader = pending is None
+                if is_leader:
+                    pending = _pending_notes[cache_key] = asyncio.get_running_loop().create_future()
+                    # Mark the outcome as retrieved even when nobody else ends up waiting
+                    pending.add_done_callback(lambda f: f.cancelled() or f.exception())
+        if cached_note is not None:
+            logger.info("Returning cached note for identical text and template")
+            # Shallow copy so the per-request timing key does not leak into the cache
+            return {**cached_note, '_generation_time': "0.00s"}
+        
+        if is_leader:
+            break
+        
+        logger.info("Waiting for identical note generation already in progress")
+        try:
+            # Shielded so a waiter that disconnects does not cancel the shared generation
+            return dict(await asyncio.shield(pending))
+        except asyncio.CancelledError:
+            if not pending.cancelled():
+                raise
+            # The leading request was cancelled, not this one: generate (or wait) afresh
+            logger.info("Leading note generation was cancelled, retrying")
+    
+    try:
+        note = await _generate_note(gemini, cleaned_text, template_json, cache_key)
+    except asyncio.CancelledError:
+        # Waiters see the cancelled future and take over the generation themselves
+        pending.cancel()
+        raise
+    except BaseException as e:
+        pending.set_exception(e)
+        raise
+    else:
+        pending.set_result(note)
+    finally:
+        with _note_cache_lock:
+            del _pending_notes[cache_key]
     
+    return note
+
+
+async def _generate_note(gemini, cleaned_text, template_json, cache_key):
+    """Call Gemini and parse its output; parsed notes are stored under cache_key"""
     try:
         logger.info("Generating medical note...")
-        start_time = time.time()
+        start_ns = time.perf_counter_ns()
         
-        generated_text = gemini.gemini_generate_note(cleaned_text, template_json)
-        elapsed = time.time() - start_time
+        generated_text = await gemini.gemini_generate_note_async(cleaned_text, template_json)
+        elapsed = (time.perf_counter_ns() - start_ns) / 1e9
+        generation_time = f"{elapsed:.2f}s"
         
-        logger.info(f"Generated text length: {len(generated_text)} characters")
-        logger.info(f"Generation took {elapsed:.2f} seconds")
+        logger.info("Generated text length: %d characters", len(generated_text))
+        logger.info("Generation took %s", generation_time)
         
         if not generated_text:
             logger.error("Model returned empty response!")
             return {"error": "Model generated empty output"}
         
-        logger.info(f"Response preview: {generated_text[:200]}...")
-        
-        # Minimal cleanup - just find JSON boundaries if model adds anything
-        if '{' in generated_text:
-            start = generated_text.find('{')
-            end = generated_text.rfind('}') + 1
-            json_text = generated_text[start:end]
-        else:
-            json_text = generated_text
+        logger.debug("Response preview: %.200s...", generated_text)
         
         # Parse JSON
         try:
-            note_json = json.loads(json_text)
+            note_json = parse_note_json(generated_text)
             logger.info("Successfully parsed JSON response")
-            note_json['_generation_time'] = f"{elapsed:.2f}s"
+            with _note_cache_lock:
+                _note_cache[cache_key] = dict(note_json)
+            note_json['_generation_time'] = generation_time
             return note_json
             
-        except json.JSONDecodeError as je:
-            logger.error(f"JSON parse failed: {str(je)}")
-            logger.error(f"Raw output: {generated_text[:500]}")
+        except json_utils.JSONDecodeError as je:
+            logger.error("JSON parse failed: %s", je)
+            logger.error("Raw output: %.500s", generated_text)
+            # Let a retry ask the model again rather than replay this answer
+            discard_response(generated_text)
             return {
                 "error": "Model did not return valid JSON", 
                 "raw_output": generated_text,
                 "parse_error": str(je),
-                "_generation_time": f"{elapsed:.2f}s"
+                "_generation_time": generation_time
             }
             
+    except GeminiOverloadedError:
+        raise
     except Exception as e:
-        logger.error(f"Error during note generation: {str(e)}")
+        logger.error("Error during note generation: %s", e)
         return {"error": str(e)}
 
 
-# Test case
+def stream_note_by_name(cleaned_text, template_name):
+    """
+    Stream a medical note using a stored template
+    
+    Args:
+        cleaned_text: The cleaned medical conversation text
+        template_name: Name of the template in the database
+    
+    Yields:
+        str: Chunks of the generated note JSON
+    
+    Raises:
+        ValueError: If the template cannot be loaded
+    """
+    template_json = load_template(template_name)
+    if template_json is None:
+        raise ValueError("Failed to load template")
+    
+    yield from stream_note_from_text(cleaned_text, template_json)
+
+
+def stream_note_from_text(cleaned_text, template_json):
+    """
+    Stream a medical note's JSON text as it is generated
+    
+    Args:
+        cleaned_text: The cleaned medical conversation text
+        template_json: JSON template (dict)
+    
+    Yields:
+        str: Chunks of the generated note JSON
+    
+    Raises:
+        RuntimeError: If Gemini is not initialized
+    """
+    gemini = get_gemini()
+    if gemini is None:
+        raise RuntimeError("Gemini not available")
+    
+    logger.info("Streaming medical note...")
+    yield from gemini.gemini_generate_note_stream(cleaned_text, template_json)
@@ -1,4 +1,6 @@
 # This module contains all LLM prompts
+from functools import lru_cache
+from . import json_utils
 
 def audio_transcription_prompt():
     """
@@ -12,14 +14,7 @@ def audio_transcription_prompt():
     return prompt
 
 
-def text_cleaner_prompt(transcribed_text):
-    """
-    Prompt for cleaning and formatting medical transcription text.
-    
-    Args:
-        transcribed
-        """
-    prompt = f"""You are an experienced **medical documentation specialist and clinical scribe** trained in converting raw speech-to-text transcriptions into accurate, professional medical notes.
+_TEXT_CLEANER_INSTRUCTIONS = """You are an experienced **medical documentation specialist and clinical scribe** trained in converting raw speech-to-text transcriptions into accurate, professional medical notes.
 
 ### Your Role
 - Act as a **medical transcription editor**, not a medical decision-maker.
@@ -57,26 +52,61 @@ def text_cleaner_prompt(transcribed_text):
 
 ---
 
-    ### Raw Transcription:
+"""
+
+
+def text_cleaner_prompt(transcribed_text):
+    """
+    Prompt for cleaning and formatting medical transcription text.
+    
+    Args:
+        transcribed
+        """
+    return text_cleaner_instructions() + text_cleaner_input(transcribed_text)
+
+
+def text_cleaner_instructions():
+    """Static part of the text cleaning prompt: role and cleaning rules (built once at import)"""
+    return _TEXT_CLEANER_INSTRUCTIONS
+
+
+def text_cleaner_input(transcribed_text):
+    """
+    Dynamic part of the text cleaning prompt: the transcription to clean.
+    Sent after text_cleaner_instructions().
+    """
+    prompt = f"""    ### Raw Transcription:
     {transcribed_text}
 
 ### Cleaned Medical Note:"""
     return prompt
 
 
-def note_generator_prompt(cleaned_text, template_json):
+def note_generator_instructions(template_json):
     """
-    Creates prompt for extracting medical info and generating structured SOAP notes.
-    Takes conversational medical text and a JSON template, returns filled template.
+    Static part of the note generation prompt: role, rules, example and the template.
+    Depends only on the template, so it can be cached server-side and reused
+    for every note generated from that template.
     """
-    import json
-    
-    # handle both dict and string inputs for template
+    return _note_generator_instructions(_template_str(template_json))
+
+
+def _template_str(template_json):
+    """Template as it appears in the prompt (handles both dict and string inputs)"""
     if isinstance(template_json, dict):
-        template_str = json.dumps(template_json, indent=2)
-    else:
-        template_str = template_json
-    
+        return _indent_template(json_utils.dumps(template_json))
+    return template_json
+
+
+@lru_cache(maxsize=64)
+def _indent_template(compact_json):
+    """Pretty-print a template for the prompt once per distinct template (keyed by its compact JSON)"""
+    return json_utils.dumps_pretty(json_utils.loads(compact_json))
+
+
+@lru_cache(maxsize=64)
+def _note_generator_instructions(template_str):
+    """Build the static note prompt once per distinct template and reuse it"""
     prompt = f"""You are a medical scribe AI trained to extract clinical information from doctor-patient conversations and organize it into structured SOAP notes.
 
 ## YOUR ROLE:
@@ -203,37 +233,81 @@ Looking at this, I'm thinking we've got a community-acquired pneumonia here, rig
 
 ---
 
-## NOW YOUR TURN - ACTUAL TASK:
-
-## CONVERSATIONAL MEDICAL TEXT:
-{cleaned_text}
-
----
-
 ## JSON TEMPLATE TO FILL:
 {template_str}
 
 ---
 
-Now extract information from the medical text and fill the template above. Remember:
+When filling the template above, remember:
 - Each field has a description (the value in the template) telling you what type of data belongs there
 - Use those descriptions as guidance for what to extract
 - For nested objects (like physical_examination), fill each sub-field according to its description
-- Start your response with opening brace {{
 - Return only valid JSON matching the template structure
 - Use "Not mentioned" for any missing information
 - Do not add explanations or extra text
 
+"""
+    
+    return prompt
+
+
+def note_generator_input(cleaned_text):
+    """
+    Dynamic part of the note generation prompt: the conversation to extract from.
+    Sent after note_generator_instructions().
+    """
+    prompt = f"""## NOW YOUR TURN - ACTUAL TASK:
+
+## CONVERSATIONAL MEDICAL TEXT:
+{cleaned_text}
+
+---
+
+Now extract information from the medical text above and fill the JSON template.
+Start your response with opening brace {{ and return only valid JSON.
+
 Begin your JSON response now:"""
     
     return prompt
 
 
-def template_extraction_prompt(document_text):
+def note_generator_prompt(cleaned_text, template_json):
     """
-    Prompt for extracting field structure from a medical document/form
+    Creates prompt for extracting medical info and generating structured SOAP notes.
+    Takes conversational medical text and a JSON template, returns filled template.
+    Static instructions come first and the conversation last, so the prefix is
+    identical across calls that use the same template.
     """
-    prompt = f"""You are a medical documentation analyst. Your task is to analyze a medical document and create a JSON TEMPLATE structure (field names with descriptions - NOT actual data).
+    return compile_note_prompt(template_json)(cleaned_text)
+
+
+def compile_note_prompt(template_json):
+    """
+    Note prompt builder specialized for one template
+    
+    Everything except the conversation is concatenated once per template, so
+    building a prompt is then a single concatenation with the cleaned text.
+    
+    Returns:
+        Callable[[str], str]: cleaned_text -> full note prompt
+    """
+    return _compile_note_prompt(_template_str(template_json))
+
+
+@lru_cache(maxsize=64)
+def _compile_note_prompt(template_str):
+    """Build (once per distinct template) the closure returned by compile_note_prompt"""
+    # Split the input section around the conversation; "\0" never occurs in the prompt text
+    head, tail = note_generator_input("\0").split("\0")
+    prefix = _note_generator_instructions(template_str) + head
+    
+    def build(cleaned_text):
+        return prefix + cleaned_text + tail
+    
+    return build
+
+
+_TEMPLATE_EXTRACTION_INSTRUCTIONS = """You are a medical documentation analyst. Your task is to analyze a medical document and create a JSON TEMPLATE structure (field names with descriptions - NOT actual data).
 
 ## YOUR ROLE:
 You are creating a reusable template from a medical form. This template will be used later to fill in patient data. You must identify field names and write descriptions of what TYPE of data belongs in each field.
@@ -260,18 +334,18 @@ You are creating a reusable template from a medical form. This template will be
 - "heart_rate": "Pulse rate in bpm"
 
 **For complex fields (nested objects):**
-{{
-  "physical_examination": {{
-    "vital_signs": {{
+{
+  "physical_examination": {
+    "vital_signs": {
       "temperature": "Body temperature in F or C",
       "blood_pressure": "BP reading in mmHg (systolic/diastolic)",
       "heart_rate": "Pulse rate in bpm",
       "respiratory_rate": "Breathing rate per minute",
       "oxygen_saturation": "O2 saturation percentage"
-    }},
+    },
     "general_findings": "Overall physical exam observations"
-  }}
-}}
+  }
+}
 
 ## GROUPING RULES:
 - **Vital signs** → Group under "vital_signs" object
@@ -317,7 +391,7 @@ Plan:
 ```
 
 **CORRECT Output (descriptions):**
-{{
+{
   "patient_name": "Full name of the patient",
   "age": "Patient's age in years",
   "sex": "Gender - Male/Female/Other",
@@ -326,31 +400,51 @@ Plan:
   "history_of_present_illness": "Detailed description of current symptoms and timeline",
   "past_medical_history": "Previous medical conditions and chronic illnesses",
   "medications": "Current medications with dosage and frequency",
-  "physical_examination": {{
-    "vital_signs": {{
+  "physical_examination": {
+    "vital_signs": {
       "temperature": "Body temperature in F or C",
       "blood_pressure": "BP reading in mmHg format (systolic/diastolic)",
       "heart_rate": "Pulse rate in beats per minute"
-    }},
+    },
     "lungs": "Lung examination findings and observations"
-  }},
+  },
   "assessment": "Doctor's diagnosis or clinical impression",
   "plan": "Treatment plan, prescriptions, and follow-up instructions"
-}}
+}
 
 **WRONG Output (actual data - DO NOT DO THIS):**
-{{
+{
   "patient_name": "John Doe",
   "age": 45,
   "temperature": 100.2,
   "blood_pressure": "135/85"
-}}
+}
 
 ## NOW YOUR TASK:
 
 Document to analyze:
 ---
-{document_text}
+"""
+
+
+def template_extraction_prompt(document_text):
+    """
+    Prompt for extracting field structure from a medical document/form
+    """
+    return template_extraction_instructions() + template_extraction_input(document_text)
+
+
+def template_extraction_instructions():
+    """Static part of the template extraction prompt: role, rules and examples (built once at import)"""
+    return _TEMPLATE_EXTRACTION_INSTRUCTIONS
+
+
+def template_extraction_input(document_text):
+    """
+    Dynamic part of the template extraction prompt: the document to analyze.
+    Sent after template_extraction_instructions().
+    """
+    prompt = f"""{document_text}
 ---
 
 Instructions:
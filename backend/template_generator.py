@@ -2,12 +2,14 @@
 import os
 import json
 import logging
-import re
+import string
+import tempfile
 from pydantic import BaseModel
 from typing import Dict, Any, List
-from .LLM.gemini import Gemini
+from .LLM.gemini import get_gemini, discard_response, GeminiOverloadedError
 from .config import MIN_TEMPLATE_FIELDS, MAX_TEMPLATE_FIELDS, TEMPLATE_DIR
-from .database import save_template as db_save_template
+from .database import save_template as db_save_template, count_fields
+from . import json_utils
 
 # Pydantic Models
 class CreateTemplateResponse(BaseModel):
@@ -41,13 +43,23 @@ class DeleteTemplateResponse(BaseModel):
 
 logger = logging.getLogger(__name__)
 
-# Initialize Gemini
-try:
-    gemini = Gemini()
-    logger.info("Gemini initialized for template generation")
-except Exception as e:
-    logger.error(f"Failed to initialize Gemini: {str(e)}")
-    gemini = None
+# Shared decoder for pulling the first JSON object out of model output
+_JSON_DECODER = json.JSONDecoder()
+
+
+class _NameCharTable(dict):
+    """str.translate table keeping ASCII letters, digits, hyphens and whitespace"""
+    
+    _ALLOWED = frozenset(string.ascii_letters + string.digits + '-')
+    
+    def __missing__(self, codepoint):
+        char = chr(codepoint)
+        value = codepoint if char in self._ALLOWED or char.isspace() else None
+        self[codepoint] = value
+        return value
+
+
+_NAME_CHAR_TABLE = _NameCharTable()
 
 
 def validate_template_name(name):
@@ -69,8 +81,8 @@ def validate_template_name(name):
         return False, "", "Template name too long (max 50 characters)"
     
     # Sanitize: keep alphanumeric, spaces, hyphens
-    sanitized = re.sub(r'[^a-zA-Z0-9\s\-]', '', name)
-    sanitized = re.sub(r'\s+', '_', sanitized.strip())
+    sanitized = name.translate(_NAME_CHAR_TABLE)
+    sanitized = '_'.join(sanitized.split())
     sanitized = sanitized.lower()
     
     if not sanitized:
@@ -109,7 +121,9 @@ def generate_template_fields(document_text):
         "error": ""
     }
     
+    generated_text = None
     try:
+        gemini = get_gemini()
         if gemini is None:
             raise RuntimeError("Gemini not initialized")
         
@@ -118,59 +132,41 @@ def generate_template_fields(document_text):
         
         generated_text = gemini.gemini_create_template(document_text)
         
-        # Extract JSON object - find first complete JSON by counting braces
+        # Parse the first JSON object; raw_decode stops at its closing brace
+        # so any trailing prose from the model is ignored
         start_idx = generated_text.find('{')
         if start_idx == -1:
             raise ValueError("No JSON found in model output")
         
-        # Find matching closing brace
-        brace_count = 0
-        end_idx = -1
-        for i in range(start_idx, len(generated_text)):
-            if generated_text[i] == '{':
-                brace_count += 1
-            elif generated_text[i] == '}':
-                brace_count -= 1
-                if brace_count == 0:
-                    end_idx = i
-                    break
-        
-        if end_idx == -1:
-            raise ValueError("No matching closing brace found in JSON")
-        
-        json_text = generated_text[start_idx:end_idx + 1]
-        
-        # Parse fields
-        fields = json.loads(json_text)
+        fields, _ = _JSON_DECODER.raw_decode(generated_text, start_idx)
         
         if not isinstance(fields, dict):
             raise ValueError("AI did not return a dict of fields")
         
-        # Count total fields (including nested)
-        def count_fields(obj):
-            count = 0
-            for value in obj.values():
-                if isinstance(value, dict):
-                    count += count_fields(value)
-                else:
-                    count += 1
-            return count
-        
-        field_count = count_fields(fields)
+        # Count total fields (including nested), stopping once over the limit
+        field_count = count_fields(fields, limit=MAX_TEMPLATE_FIELDS)
+        if field_count > MAX_TEMPLATE_FIELDS:
+            raise ValueError(f"AI returned too many fields (max {MAX_TEMPLATE_FIELDS})")
         
         result["success"] = True
         result["fields"] = fields
-        logger.info(f"Template fields extracted: {field_count}")
+        logger.info("Template fields extracted: %d", field_count)
         
     except json.JSONDecodeError as e:
         error_msg = f"Failed to parse AI response: {str(e)}"
         logger.error(error_msg)
         result["error"] = error_msg
+    except GeminiOverloadedError:
+        raise
     except Exception as e:
         error_msg = str(e)
-        logger.error(f"Field extraction error: {error_msg}")
+        logger.error("Field extraction error: %s", error_msg)
         result["error"] = error_msg
     
+    # An unusable answer must not be replayed from the response cache on retry
+    if not result["success"] and generated_text:
+        discard_response(generated_text)
+    
     return result
 
 
@@ -198,26 +194,31 @@ def save_template(template_name, display_name, fields):
         
         template_path = os.path.join(TEMPLATE_DIR, f"{template_name}.json")
         
-        # Check if exists
-        if os.path.exists(template_path):
-            raise FileExistsError(f"Template '{template_name}' already exists")
-        
         # Create template structure
         template_data = {
             "template": display_name,
             "fields": fields
         }
-        
-        with open(template_path, 'w') as f:
-            json.dump(template_data, f, indent=2)
+        data = json_utils.dumps_pretty(template_data).encode('utf-8')
+        
+        # Write a temp file, then hard-link it into place: the template appears
+        # complete or not at all, and the link fails if the name is taken
+        with tempfile.NamedTemporaryFile('wb', dir=TEMPLATE_DIR, suffix='.tmp', delete=False) as f:
+            f.write(data)
+        try:
+            os.link(f.name, template_path)
+        except FileExistsError:
+            raise FileExistsError(f"Template '{template_name}' already exists") from None
+        finally:
+            os.unlink(f.name)
         
         result["success"] = True
         result["path"] = template_path
-        logger.info(f"Template saved: {os.path.basename(template_path)}")
+        logger.info("Template saved: %s", os.path.basename(template_path))
         
     except Exception as e:
         error_msg = str(e)
-        logger.error(f"Template save error: {error_msg}")
+        logger.error("Template save error: %s", error_msg)
         result["error"] = error_msg
     
     return result
@@ -268,14 +269,13 @@ def create_template_from_document(file_path, template_name):
         result["fields"] = fields
         result["template_name"] = template_name
         
-        logger.info(f"Template '{template_name}' created successfully with {len(fields)} fields")
+        logger.info("Template '%s' created successfully with %d fields", template_name, len(fields))
         
+    except GeminiOverloadedError:
+        raise
     except Exception as e:
         error_msg = str(e)
-        logger.error(f"Template creation error: {error_msg}")
+        logger.error("Template creation error: %s", error_msg)
         result["error"] = error_msg
     
     return result
-
-
-# Test
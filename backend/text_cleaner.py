@@ -1,10 +1,11 @@
 # This module handles medical text cleaning and restructuring using Gemini
 
+import asyncio
 import logging
-import os
+import re
 import time
 from pydantic import BaseModel
-from .LLM.gemini import Gemini
+from .LLM.gemini import get_gemini, GeminiOverloadedError
 
 # Pydantic Models
 class CleanTextRequest(BaseModel):
@@ -16,32 +17,56 @@ class CleanTextResponse(BaseModel):
     time_elapsed: float = 0.0
     error: str = ""
 
-# Configure logging
-LOG_DIR = "logs"
-if not os.path.exists(LOG_DIR):
-    os.makedirs(LOG_DIR)
+logger = logging.getLogger(__name__)
 
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(os.path.join(LOG_DIR, 'text_cleaner.log')),
-        logging.StreamHandler()
-    ]
-)
+# Pure disfluencies only. Words like "like" or "kind of" can carry clinical
+# meaning ("feels like pressure") and "er" can be "ER", so those are left to the model.
+_FILLER_RE = re.compile(r"\b(?:u+m+|u+h+|uhm|erm|hm+)\b,?[ \t]*", re.IGNORECASE)
+
+# Longer transcripts are cleaned in sentence-aligned chunks of about this many
+# characters (~1000 tokens) so each cleaned chunk fits in MAX_TOKENS_CLEANER
+CLEAN_CHUNK_CHARS = 4000
+# The captured whitespace is put back inside a chunk so line breaks survive
+_SENTENCE_BREAK_RE = re.compile(r"(?<=[.!?])(\s+)")
 
-logger = logging.getLogger(__name__)
 
-# Initialize Gemini
-try:
-    gemini = Gemini()
-    logger.info("Gemini initialized for text cleaning")
-except Exception as e:
-    logger.error(f"Failed to initialize Gemini: {str(e)}")
-    gemini = None
+def strip_fillers(text):
+    """Remove filler sounds (um, uh, erm, hmm) in one regex pass"""
+    return _FILLER_RE.sub("", text)
+
+
+def chunk_text(text, max_chars=CLEAN_CHUNK_CHARS):
+    """
+    Split text into chunks of at most max_chars, breaking only between sentences
+    
+    A single sentence longer than max_chars becomes a chunk of its own. The
+    whitespace between sentences in the same chunk is kept as it was.
+    
+    Returns:
+        list: Chunks in order (just [text] if it is already short enough)
+    """
+    if len(text) <= max_chars:
+        return [text]
+    
+    # split() alternates sentence, separator, sentence, ...
+    pieces = _SENTENCE_BREAK_RE.split(text)
+    chunks = []
+    current = [pieces[0]]
+    current_len = len(pieces[0])
+    for i in range(1, len(pieces), 2):
+        separator, sentence = pieces[i], pieces[i + 1]
+        if current_len + len(separator) + len(sentence) > max_chars:
+            chunks.append("".join(current))
+            current = [sentence]
+            current_len = len(sentence)
+        else:
+            current += (separator, sentence)
+            current_len += len(separator) + len(sentence)
+    chunks.append("".join(current))
+    return chunks
 
 
-def format_text(transcribed_text):
+async def format_text(transcribed_text):
     """
     Format and clean transcribed medical text.
     
@@ -55,32 +80,44 @@ def format_text(transcribed_text):
         if not transcribed_text:
             raise ValueError("Input text is empty")
         
+        gemini = get_gemini()
         if gemini is None:
             raise RuntimeError("Gemini not initialized")
         
-        start_time = time.time()
-        formatted_text = gemini.gemini_clean_text(transcribed_text)
-        elapsed = time.time() - start_time
+        # Fewer input tokens for the model; it would drop these anyway
+        transcribed_text = strip_fillers(transcribed_text)
+        
+        # Long dictations are cleaned chunk by chunk, concurrently. The first
+        # failure (e.g. overload) cancels the chunks still in flight.
+        chunks = chunk_text(transcribed_text)
+        start_time = time.perf_counter()
+        try:
+            async with asyncio.TaskGroup() as group:
+                tasks = [group.create_task(gemini.gemini_clean_text_async(chunk)) for chunk in chunks]
+        except ExceptionGroup as eg:
+            raise eg.exceptions[0] from None
+        formatted_text = "\n".join(task.result() for task in tasks)
+        elapsed = time.perf_counter() - start_time
         
-        logger.info(f"Formatted: {len(formatted_text)} chars in {elapsed:.2f}s")
+        logger.info("Formatted: %d chars (%d chunks) in %.2fs", len(formatted_text), len(chunks), elapsed)
         
         return formatted_text
         
     except ValueError as e:
-        error_msg = f"Validation error: {str(e)}"
-        logger.error(error_msg)
+        logger.error("Validation error: %s", e)
         return None
+    except GeminiOverloadedError:
+        raise
     except RuntimeError as e:
-        error_msg = f"Runtime error: {str(e)}"
-        logger.error(error_msg)
+        logger.error("Runtime error: %s", e)
         return None
     except Exception as e:
-        error_msg = f"Formatting error: {str(e)}"
-        logger.error(error_msg, exc_info=True)
+        # Tracebacks only when debugging; formatting them costs more than the message
+        logger.error("Formatting error: %s", e, exc_info=logger.isEnabledFor(logging.DEBUG))
         return None
 
 
-def clean_text(transcribed_text):
+async def clean_text(transcribed_text):
     """
     Clean and format transcribed medical text.
     
@@ -97,7 +134,7 @@ def clean_text(transcribed_text):
     }
     
     try:
-        formatted = format_text(transcribed_text)
+        formatted = await format_text(transcribed_text)
         if formatted is None:
             raise ValueError("Formatting failed")
         
@@ -106,8 +143,10 @@ def clean_text(transcribed_text):
         
         return result
         
+    except GeminiOverloadedError:
+        raise
     except Exception as e:
         error_msg = str(e)
-        logger.error(f"Pipeline error: {error_msg}", exc_info=True)
+        logger.error("Pipeline error: %s", error_msg, exc_info=logger.isEnabledFor(logging.DEBUG))
         result['error'] = error_msg
         return result
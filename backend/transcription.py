@@ -1,60 +1,41 @@
 # This module handles audio transcription using Whisper or Gemini
 
+import asyncio
 import logging
-import os
-from .LLM.gemini import Gemini
-# from .LLM.whisper import Whisper
-
-# Configure logging
-LOG_DIR = "logs"
-if not os.path.exists(LOG_DIR):
-    os.makedirs(LOG_DIR)
-
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(os.path.join(LOG_DIR, 'transcription.log')),
-        logging.StreamHandler()
-    ]
-)
+from .LLM.gemini import get_gemini
+# from .LLM.whisper import get_whisper
 
 logger = logging.getLogger(__name__)
 
-# Initialize Gemini
-try:
-    gemini = Gemini()
-    logger.info("Gemini loaded for transcription")
-except Exception as e:
-    logger.error(f"Failed to load Gemini: {str(e)}")
-    gemini = None
-
 # Initialize Whisper (commented out)
 # try:
-#     whisper = Whisper(model_size="medium", device="cpu", compute_type="int8")
+#     whisper = get_whisper()  # Shared instance (WHISPER_MODEL), warmed up on load; uses CUDA int8_float16 when available
 #     logger.info("Whisper model loaded")
 # except Exception as e:
-#     logger.error(f"Failed to load Whisper: {str(e)}")
+#     logger.error("Failed to load Whisper: %s", e)
 #     whisper = None
 
 
-def transcribe_audio(file_path):
+def transcribe_audio(file_path, file_name=None):
     """
     Transcribe audio file to text using Gemini.
     
     Args:
-        file_path (str): Path to the audio file
+        file_path (str | BinaryIO): Path to the audio file, or an open binary
+            file such as an upload's spooled file
+        file_name (str): Original file name, for the MIME type of file objects
         
     Returns:
         dict: Dictionary with transcription result
     """
+    gemini = get_gemini()
     if gemini is None:
         return {
             'success': False,
             'error': 'Gemini not initialized'
         }
     
-    return gemini.gemini_transcribe(file_path)
+    return gemini.gemini_transcribe(file_path, file_name=file_name)
     
     # Whisper transcription (commented out)
     # if whisper is None:
@@ -64,3 +45,23 @@ def transcribe_audio(file_path):
     #     }
     # 
     # return whisper.whisper_transcribe(file_path)
+
+
+async def transcribe_audio_batch(file_paths):
+    """
+    Transcribe several audio files concurrently using Gemini.
+    
+    Uploads and processing waits overlap instead of running one file after
+    another; admission control in the Gemini client still bounds the calls in flight.
+    
+    Args:
+        file_paths (list): Paths to the audio files
+    
+    Returns:
+        list: One transcription result dict per file, in the same order
+    """
+    gemini = get_gemini()
+    if gemini is None:
+        return [{'success': False, 'error': 'Gemini not initialized'} for _ in file_paths]
+    
+    return list(await asyncio.gather(*(gemini.gemini_transcribe_async(path) for path in file_paths)))
@@ -0,0 +1,14 @@
+# Gunicorn settings, used when ASGI_SERVER=gunicorn (or `gunicorn -c gunicorn.conf.py main:app`)
+# The app is imported once in the master and forked into Uvicorn workers,
+# so imported code and data are shared copy-on-write instead of loaded per worker
+from backend.config import HOST, PORT, UDS_PATH, WEB_CONCURRENCY, KEEPALIVE_TIMEOUT, BACKLOG
+
+bind = f"unix:{UDS_PATH}" if UDS_PATH else f"{HOST}:{PORT}"
+workers = WEB_CONCURRENCY
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+keepalive = KEEPALIVE_TIMEOUT
+backlog = BACKLOG
+# SO_REUSEPORT on the listening socket (Linux/BSD), so a restarted master can bind
+# while the old one is still draining
+reuse_port = True
@@ -1,26 +1,68 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, Form
-from fastapi.responses import JSONResponse, HTMLResponse, StreamingResponse
+from fastapi import FastAPI, UploadFile, File, HTTPException, Form, Request
+from fastapi.responses import JSONResponse, HTMLResponse, StreamingResponse, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from typing import Dict, Any
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager
+import asyncio
+import hashlib
 import logging
 import os
-import json
+import sys
 import time
 import shutil
+import stat
 from pathlib import Path
 
 # Import modules and their models
 from backend.text_cleaner import clean_text, CleanTextRequest, CleanTextResponse
-from backend.note_generator import generate_note_from_text, load_template, GenerateNoteRequest, GenerateNoteResponse
+from backend.note_generator import generate_note_by_name, stream_note_by_name, parse_note_json, NoteStreamParser, load_template, GenerateNoteRequest, GenerateNoteResponse
 from backend.template_generator import create_template_from_document, CreateTemplateResponse
 from backend.transcription import transcribe_audio
 from backend.note_formatter import format_medical_note, format_template_document
-from backend.config import TEMPLATE_DIR, ALLOWED_EXTENSIONS, MAX_UPLOAD_SIZE
+from backend.config import TEMPLATE_DIR, ALLOWED_EXTENSIONS, MAX_UPLOAD_SIZE, UPLOAD_COPY_BUFFER, DOCX_WORKERS
+from backend.config import ALLOWED_AUDIO_EXTENSIONS, MAX_AUDIO_UPLOAD_SIZE
 from backend.docx_generator import generate_note_docx, generate_template_docx, get_note_filename, get_template_filename
+from backend.database import init_database, close_connections
+from backend.LLM.gemini import GeminiOverloadedError, prewarm_gemini, start_upload_sweeper, close_gemini, discard_response
+from backend import json_utils
+from backend.logging_setup import setup_logging
 
-app = FastAPI(title="Medical Note Generator API", version="1.0.0")
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered with json_utils (orjson when installed)"""
+    
+    def render(self, content) -> bytes:
+        return json_utils.dumpb(content)
+
+# STARTUP & SHUTDOWN
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Set up shared resources before the server accepts requests and release them on shutdown"""
+    # Create the templates table and default templates on first run
+    init_database()
+    # Word documents are built in separate processes so concurrent exports use all cores
+    app.state.docx_pool = ProcessPoolExecutor(max_workers=DOCX_WORKERS)
+    # Connect to Gemini up front and start deleting expired audio uploads
+    await prewarm_gemini()
+    start_upload_sweeper()
+    try:
+        yield
+    finally:
+        app.state.docx_pool.shutdown(cancel_futures=True)
+        await close_gemini()
+        close_connections()
+
+app = FastAPI(
+    title="Medical Note Generator API",
+    version="1.0.0",
+    default_response_class=FastJSONResponse,
+    lifespan=lifespan
+)
 
 # Add CORS middleware
 ALLOWED_ORIGINS = os.getenv("ALLOWED_ORIGINS", "*").split(",")
@@ -32,13 +74,66 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Compress JSON/HTML bodies over 1 KB (note HTML and templates compress several-fold);
+# level 5 keeps CPU low, and the SSE stream is left uncompressed by the middleware
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=5)
+
 # Mount static files
 app.mount("/static", StaticFiles(directory="frontend/static"), name="static")
 app.mount("/public", StaticFiles(directory="frontend/public"), name="public")
 
-logging.basicConfig(level=logging.INFO)
+setup_logging()
 logger = logging.getLogger(__name__)
 
+@app.exception_handler(GeminiOverloadedError)
+async def gemini_overloaded_handler(request, exc):
+    """Answer 503 when too many Gemini calls are pending, so clients back off instead of queueing"""
+    return FastJSONResponse(
+        status_code=503,
+        content={"success": False, "error": str(exc)},
+        headers={"Retry-After": "5"}
+    )
+
+def _kernel_copy(src, path):
+    """
+    Copy src to path inside the kernel with os.copy_file_range
+    
+    Only used when src is backed by a regular file on disk (a spooled upload
+    that has rolled over). Returns False if the fast path is unavailable.
+    """
+    if not hasattr(os, "copy_file_range") or not getattr(src, "_rolled", True):
+        return False
+    
+    try:
+        src.flush()
+        src_fd = src.fileno()
+        st = os.fstat(src_fd)
+        if not stat.S_ISREG(st.st_mode):
+            return False
+        
+        offset = src.tell()
+        dst_fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            while offset < st.st_size:
+                copied = os.copy_file_range(src_fd, dst_fd, st.st_size - offset, offset)
+                if copied == 0:
+                    break
+                offset += copied
+        finally:
+            os.close(dst_fd)
+        return True
+    except (OSError, ValueError):
+        # Unsupported fd or filesystem; the buffered copy below truncates path
+        return False
+
+def _save_upload(src, path):
+    """Copy an uploaded file's contents to path"""
+    if _kernel_copy(src, path):
+        return
+    
+    with open(path, "wb") as f:
+        shutil.copyfileobj(src, f, UPLOAD_COPY_BUFFER)
+
 # RESPONSE MODELS FOR COMBINED ENDPOINTS
 
 class TranscribeAndCleanResponse(BaseModel):
@@ -57,13 +152,27 @@ class DownloadNoteRequest(BaseModel):
 
 # FRONTEND & HEALTH CHECK
 
+def _etag(body: bytes) -> str:
+    """Strong ETag for a response body"""
+    return f'"{hashlib.blake2b(body, digest_size=8).hexdigest()}"'
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    """True if the request's If-None-Match lists etag"""
+    if_none_match = request.headers.get("if-none-match")
+    return bool(if_none_match) and etag in (tag.strip().removeprefix("W/") for tag in if_none_match.split(","))
+
+# The landing page only changes on deploy, so it is read once at import
+_INDEX_PATH = Path("frontend/public/index.html")
+_INDEX_BYTES = _INDEX_PATH.read_bytes() if _INDEX_PATH.exists() else b"<h1>Medical Note Generator</h1><p>Frontend not found</p>"
+_INDEX_ETAG = _etag(_INDEX_BYTES)
+
 @app.get("/", response_class=HTMLResponse)
-async def serve_frontend():
-    """Serve the frontend HTML"""
-    index_path = Path("frontend/public/index.html")
-    if index_path.exists():
-        return index_path.read_text(encoding="utf-8")
-    return "<h1>Medical Note Generator</h1><p>Frontend not found</p>"
+async def serve_frontend(request: Request):
+    """Serve the frontend HTML (304 when If-None-Match carries the current ETag)"""
+    headers = {"ETag": _INDEX_ETAG, "Cache-Control": "public, max-age=60"}
+    if _etag_matches(request, _INDEX_ETAG):
+        return Response(status_code=304, headers=headers)
+    return HTMLResponse(content=_INDEX_BYTES, headers=headers)
 
 @app.get("/health")
 def health_check():
@@ -92,44 +201,41 @@ async def transcribe_and_clean_audio(audio: UploadFile = File(...)):
             "error": str (only on failure)
         }
     """
+    # Reject unsupported or oversized audio before anything is sent to the model
+    if Path(audio.filename or "").suffix.lower() not in ALLOWED_AUDIO_EXTENSIONS:
+        return FastJSONResponse(
+            status_code=415,
+            content={"success": False, "error": f"Invalid audio type. Allowed: {', '.join(ALLOWED_AUDIO_EXTENSIONS)}"}
+        )
+    if audio.size is not None and audio.size > MAX_AUDIO_UPLOAD_SIZE:
+        return FastJSONResponse(
+            status_code=413,
+            content={"success": False, "error": f"Audio file too large (max {MAX_AUDIO_UPLOAD_SIZE // (1024 * 1024)}MB)"}
+        )
+    
     try:
-        total_start = time.time()
+        total_start = time.perf_counter()
         
-        # Save uploaded audio file temporarily
-        temp_audio = f"temp_audio_{int(time.time())}{Path(audio.filename).suffix}"
-        try:
-            with open(temp_audio, "wb") as f:
-                shutil.copyfileobj(audio.file, f)
-            
-            # Step 1 - Transcribe audio using Whisper
-            transcription_start = time.time()
-            transcription_result = transcribe_audio(temp_audio)
-            transcription_time = time.time() - transcription_start
-            
-            if not transcription_result['success']:
-                return TranscribeAndCleanResponse(
-                    success=False,
-                    error=f"Transcription failed: {transcription_result.get('error', 'Unknown error')}",
-                    total_time=time.time() - total_start
-                )
-            
-            transcription = transcription_result['text']
-            logger.info(f"Transcription completed: {len(transcription)} chars in {transcription_time:.2f}s")
-            
-        finally:
-            # Cleanup temp audio file
-            if os.path.exists(temp_audio):
-                try:
-                    os.remove(temp_audio)
-                except:
-                    pass
+        # Step 1 - Transcribe audio straight from the uploaded file (no temp copy);
+        # the blocking upload and polling run in the threadpool, off the event loop
+        transcription_start = time.perf_counter()
+        transcription_result = await run_in_threadpool(transcribe_audio, audio.file, audio.filename)
+        transcription_time = time.perf_counter() - transcription_start
+        
+        if not transcription_result['success']:
+            return TranscribeAndCleanResponse(
+                success=False,
+                error=f"Transcription failed: {transcription_result.get('error', 'Unknown error')}",
+                total_time=time.perf_counter() - total_start
+            )
+        
+        transcription = transcription_result['text']
+        logger.info("Transcription completed: %d chars in %.2fs", len(transcription), transcription_time)
         
         # Step 2 - Clean text
-        cleaning_start = time.time()
-        cleaned_result = clean_text(transcription)
-        cleaning_time = time.time() - cleaning_start
+        cleaned_result = await clean_text(transcription)
         
-        total_time = time.time() - total_start
+        total_time = time.perf_counter() - total_start
         
         if cleaned_result['success']:
             return TranscribeAndCleanResponse(
@@ -144,8 +250,10 @@ async def transcribe_and_clean_audio(audio: UploadFile = File(...)):
                 total_time=total_time
             )
             
+    except GeminiOverloadedError:
+        raise
     except Exception as e:
-        logger.error(f"Transcribe and clean error: {e}")
+        logger.error("Transcribe and clean error: %s", e)
         return TranscribeAndCleanResponse(
             success=False,
             error=str(e),
@@ -174,11 +282,11 @@ async def generate_medical_note(request: GenerateNoteRequest):
         }
     """
     try:
-        start = time.time()
+        start = time.perf_counter()
         
         # Generate note using template from database
-        result = generate_note_from_text(request.cleaned_text, request.template_name)
-        elapsed = time.time() - start
+        result = await generate_note_by_name(request.cleaned_text, request.template_name)
+        elapsed = time.perf_counter() - start
         
         if "error" in result:
             return GenerateNoteResponse(
@@ -195,20 +303,76 @@ async def generate_medical_note(request: GenerateNoteRequest):
             time_elapsed=elapsed,
             formatted_html=formatted_html
         )
+    except GeminiOverloadedError:
+        raise
     except Exception as e:
-        logger.error(f"Note generation error: {e}")
+        logger.error("Note generation error: %s", e)
         return GenerateNoteResponse(
             success=False,
             error=str(e)
         )
 
+@app.post("/generate-note/stream")
+async def generate_medical_note_stream(request: GenerateNoteRequest):
+    """
+    Step 2 (streaming): Generate medical note as Server-Sent Events
+    
+    Args:
+        request: Same as /generate-note
+    
+    Returns:
+        text/event-stream of:
+            data: {"text": str}            (one event per generated chunk)
+            event: field, data: {"key": str, "value": any}
+                                           (each top-level field as soon as it is complete)
+            event: note, data: {"medical_note": dict, "formatted_html": str}
+                                           (parsed note once generation finishes)
+            event: done                    (generation finished)
+            event: error, data: {"error": str}
+    """
+    def events():
+        try:
+            chunks = []
+            parser = NoteStreamParser()
+            fields = {}
+            for chunk in stream_note_by_name(request.cleaned_text, request.template_name):
+                chunks.append(chunk)
+                yield f"data: {json_utils.dumps({'text': chunk})}\n\n"
+                for key, value in parser.feed(chunk):
+                    fields[key] = value
+                    yield f"event: field\ndata: {json_utils.dumps({'key': key, 'value': value})}\n\n"
+            
+            # The incremental parse already holds the whole note unless the output was malformed
+            try:
+                note = fields if parser.done else parse_note_json("".join(chunks))
+            except json_utils.JSONDecodeError:
+                discard_response("".join(chunks))
+                raise
+            payload = {
+                "medical_note": note,
+                "formatted_html": format_medical_note(note, request.template_name)
+            }
+            yield f"event: note\ndata: {json_utils.dumps(payload)}\n\n"
+            yield "event: done\ndata: {}\n\n"
+        except Exception as e:
+            logger.error("Note streaming error: %s", e)
+            yield f"event: error\ndata: {json_utils.dumps({'error': str(e)})}\n\n"
+    
+    return StreamingResponse(events(), media_type="text/event-stream")
+
 # API 3: LIST TEMPLATES
 
+# Response body and its ETag, rebuilt only when the database layer hands
+# back a different (i.e. re-queried) listing
+_templates_body = {"source": None, "body": b"", "etag": ""}
+
 @app.get("/templates")
-async def list_all_templates():
+async def list_all_templates(request: Request):
     """
     Get list of all available templates
     
+    Answers 304 Not Modified when If-None-Match carries the current ETag.
+    
     Returns:
         {
             "success": bool,
@@ -216,14 +380,26 @@ async def list_all_templates():
         }
     """
     try:
-        from backend.database import list_templates
-        templates = list_templates()
-        return {
-            "success": True,
-            "templates": templates
-        }
+        from backend.database import list_templates_json_bytes
+        templates = await run_in_threadpool(list_templates_json_bytes)
+        
+        cached = _templates_body
+        if cached["source"] is not templates:
+            body = b'{"success":true,"templates":' + templates + b"}"
+            cached = {
+                "source": templates,
+                "body": body,
+                "etag": _etag(body)
+            }
+            _templates_body.update(cached)
+        
+        # no-cache: browsers keep the listing but revalidate it on every poll
+        headers = {"ETag": cached["etag"], "Cache-Control": "no-cache"}
+        if _etag_matches(request, cached["etag"]):
+            return Response(status_code=304, headers=headers)
+        return Response(content=cached["body"], media_type="application/json", headers=headers)
     except Exception as e:
-        logger.error(f"Error listing templates: {e}")
+        logger.error("Error listing templates: %s", e)
         return {
             "success": False,
             "error": str(e),
@@ -253,7 +429,7 @@ async def create_template(document: UploadFile = File(...), template_name: str =
     """
     temp_file = None
     try:
-        start = time.time()
+        start = time.perf_counter()
         
         # Validate file extension
         file_ext = Path(document.filename).suffix.lower()
@@ -263,14 +439,20 @@ async def create_template(document: UploadFile = File(...), template_name: str =
                 error=f"Invalid file type. Allowed: {', '.join(ALLOWED_EXTENSIONS)}"
             )
         
+        # Validate size before writing anything to disk
+        if document.size is not None and document.size > MAX_UPLOAD_SIZE:
+            return CreateTemplateResponse(
+                success=False,
+                error=f"File too large (max {MAX_UPLOAD_SIZE // (1024 * 1024)}MB)"
+            )
+        
         # Save uploaded file temporarily
         temp_file = f"temp_{int(time.time())}{file_ext}"
-        with open(temp_file, "wb") as f:
-            shutil.copyfileobj(document.file, f)
+        await run_in_threadpool(_save_upload, document.file, temp_file)
         
-        # Create template
-        result = create_template_from_document(temp_file, template_name)
-        elapsed = time.time() - start
+        # Create template (text extraction and the model call block, so off the event loop)
+        result = await run_in_threadpool(create_template_from_document, temp_file, template_name)
+        elapsed = time.perf_counter() - start
         
         if result["success"]:
             # Format template as HTML
@@ -289,18 +471,20 @@ async def create_template(document: UploadFile = File(...), template_name: str =
                 success=False,
                 error=result["error"]
             )
+    except GeminiOverloadedError:
+        raise
     except Exception as e:
-        logger.error(f"Template creation error: {e}")
+        logger.error("Template creation error: %s", e)
         return CreateTemplateResponse(
             success=False,
             error=str(e)
         )
     finally:
         # Cleanup temp file
-        if temp_file and os.path.exists(temp_file):
+        if temp_file:
             try:
-                os.remove(temp_file)
-            except:
+                Path(temp_file).unlink(missing_ok=True)
+            except OSError:
                 pass
 
 # API 5: DOWNLOAD TEMPLATE AS WORD
@@ -317,18 +501,21 @@ async def download_template(request: DownloadTemplateRequest):
         Word document file
     """
     try:
-        doc_io = generate_template_docx(request.template_name, request.fields)
+        doc_io = await asyncio.get_running_loop().run_in_executor(
+            app.state.docx_pool, generate_template_docx, request.template_name, request.fields
+        )
         filename = get_template_filename(request.template_name)
         
-        return StreamingResponse(
-            doc_io,
+        # A few hundred KB at most, already in memory: send it as one body
+        return Response(
+            content=doc_io.getvalue(),
             media_type="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
             headers={"Content-Disposition": f"attachment; filename={filename}"}
         )
         
     except Exception as e:
-        logger.error(f"Template download error: {e}")
-        return JSONResponse(
+        logger.error("Template download error: %s", e)
+        return FastJSONResponse(
             status_code=500,
             content={"error": str(e)}
         )
@@ -345,18 +532,21 @@ async def download_note(request: DownloadNoteRequest):
         Word document file
     """
     try:
-        doc_io = generate_note_docx(request.template_name, request.note_data)
+        doc_io = await asyncio.get_running_loop().run_in_executor(
+            app.state.docx_pool, generate_note_docx, request.template_name, request.note_data
+        )
         filename = get_note_filename()
         
-        return StreamingResponse(
-            doc_io,
+        # A few hundred KB at most, already in memory: send it as one body
+        return Response(
+            content=doc_io.getvalue(),
             media_type="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
             headers={"Content-Disposition": f"attachment; filename={filename}"}
         )
         
     except Exception as e:
-        logger.error(f"Note download error: {e}")
-        return JSONResponse(
+        logger.error("Note download error: %s", e)
+        return FastJSONResponse(
             status_code=500,
             content={"error": str(e)}
         )
@@ -364,44 +554,80 @@ async def download_note(request: DownloadNoteRequest):
 
 
 if __name__ == "__main__":
+    import importlib.util
     import uvicorn
-    from backend.config import RELOAD, APP_ENV
+    from backend.config import RELOAD, APP_ENV, HOST, PORT, UDS_PATH, WEB_CONCURRENCY
+    from backend.config import KEEPALIVE_TIMEOUT, LIMIT_CONCURRENCY, BACKLOG, ASGI_SERVER
     
-    # Get port and host from environment (Render provides these)
-    port = int(os.getenv("PORT", 8000))
-    host = os.getenv("HOST", "0.0.0.0")
-    reload = os.getenv("RELOAD", "false").lower() == "true" if APP_ENV == "development" else False
+    # Port and host come from the environment (Render provides these)
+    reload = APP_ENV == "development" and RELOAD
     
     # Production-ready configuration
     uvicorn_config = {
-        "host": host,
-        "port": port,
+        "host": HOST,
+        "port": PORT,
         "reload": reload,
+        # C event loop and HTTP parser when installed (uvloop has no Windows build),
+        # otherwise the pure-Python asyncio loop and h11
+        "loop": "uvloop" if sys.platform != "win32" and importlib.util.find_spec("uvloop") else "asyncio",
+        "http": "httptools" if importlib.util.find_spec("httptools") else "h11",
+        # One formatted log line per request is only worth it while debugging;
+        # in production Render's edge already logs every request
+        "access_log": APP_ENV == "development",
+        # Shed bursts with 503s instead of queueing until memory runs out
+        "timeout_keep_alive": KEEPALIVE_TIMEOUT,
+        "limit_concurrency": LIMIT_CONCURRENCY,
+        "backlog": BACKLOG,
     }
     
+    # A proxy on the same host can reach a Unix socket without going through TCP
+    if UDS_PATH:
+        del uvicorn_config["host"], uvicorn_config["port"]
+        uvicorn_config["uds"] = UDS_PATH
+    
+    # Uvicorn cannot reload and run several workers at once, so development stays single-process
+    if not reload:
+        uvicorn_config["workers"] = WEB_CONCURRENCY
+    
     # Only include reload settings in development
     if APP_ENV == "development" and reload:
         uvicorn_config.update({
-            "reload_dirs": ["./backend", "./"],
-            "reload_excludes": [
-                "*.pyc",
-                "__pycache__",
-                "*.log",
-                "*.tmp",
-                "temp_*",
-                "*.db",
-                "*.sqlite",
-                ".git",
-                "venv",
-                ".venv",
-                "models/*",
-                "*.gguf"
-            ]
+            # Watching the repo root would also walk .git and the virtualenv;
+            # edits to main.py itself need a manual restart
+            "reload_dirs": ["./backend"],
+            # Only source changes restart the server; logs, databases and temp files never do
+            "reload_includes": ["*.py"]
         })
     
-    logger.info(f"Starting server in {APP_ENV} mode on {host}:{port}")
+    # Granian parses HTTP and drives the sockets in Rust; it replaces this process
+    # and serves the same app (production only, uvicorn keeps the reloader)
+    if ASGI_SERVER == "granian" and not reload and not UDS_PATH:
+        if shutil.which("granian"):
+            logger.info("Starting Granian in %s mode on %s:%s", APP_ENV, HOST, PORT)
+            os.execvp("granian", [
+                "granian", "--interface", "asgi", "--http", "auto",
+                "--host", HOST, "--port", str(PORT),
+                "--workers", str(WEB_CONCURRENCY), "--backlog", str(BACKLOG),
+                "main:app"
+            ])
+        logger.warning("ASGI_SERVER=granian but granian is not installed; using uvicorn")
+    
+    # Gunicorn imports the app once and forks Uvicorn workers from it (gunicorn.conf.py)
+    if ASGI_SERVER == "gunicorn" and not reload:
+        if shutil.which("gunicorn"):
+            logger.info("Starting Gunicorn in %s mode", APP_ENV)
+            conf = os.path.join(os.path.dirname(os.path.abspath(__file__)), "gunicorn.conf.py")
+            os.execvp("gunicorn", ["gunicorn", "-c", conf, "main:app"])
+        logger.warning("ASGI_SERVER=gunicorn but gunicorn is not installed; using uvicorn")
+    
+    address = UDS_PATH or f"{HOST}:{PORT}"
+    logger.info("Starting server in %s mode on %s", APP_ENV, address)
     
+    # Reload and multi-worker runs need an import string so each process can import
+    # the app itself; a single worker serves this already-imported app instead of
+    # importing main a second time
+    single_process = not reload and uvicorn_config.get("workers", 1) == 1
     uvicorn.run(
-        "main:app",
+        app if single_process else "main:app",
         **uvicorn_config
     )
\ No newline at end of file